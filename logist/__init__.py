@@ -1,50 +1,1683 @@
 import json
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import gzip
-import shutil
 import csv
+import struct
+from collections import deque
+from itertools import islice
+import time
+import atexit
+import threading
+import multiprocessing
+import mmap
+import uuid
+import re
+import errno
+from array import array
+from bisect import bisect_left, bisect_right
 
 try:
-    from redis import Redis, ConnectionError
+    from Queue import Queue, Full, Empty
 except ImportError:
-    print "Redis is not Installed"
-    exit()
+    from queue import Queue, Full, Empty
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+
+try:
+    from redis import Redis, ConnectionError, ResponseError, ConnectionPool, UnixDomainSocketConnection
+    # redis' TimeoutError is no ConnectionError, and not the builtin of Python 3 either
+    from redis import TimeoutError as RedisTimeoutError
+    # redis is unreachable, or too slow to answer
+    REDIS_UNAVAILABLE = (ConnectionError, RedisTimeoutError)
+    try:
+        # newer redis-py retries commands that time out on its own (10 times since 6.0), which would multiply
+        # REDIS_TIMEOUT; logist spools and retries by itself
+        from redis.retry import Retry
+        from redis.backoff import NoBackoff
+        _redis_options = {"retry": Retry(NoBackoff(), 0)}
+    except ImportError:
+        _redis_options = {}
+except ImportError:
+    # only needed for the redis backend
+    Redis = None
+    REDIS_UNAVAILABLE = ()
 
 __version__ = "0.99.1"
 
+# number of entries moved from redis to the log file per round-trip while flushing
+FLUSH_CHUNK_SIZE = 10000
+
+# upper bounds, in seconds, of the flush duration histogram reported by stats()
+FLUSH_HISTOGRAM = (0.001, 0.01, 0.1, 1.0, 10.0, float("inf"))
+
+# seconds a detached (staging) batch may go without progress before another flusher takes it over
+STAGING_LEASE = 60
+
+# seconds between the background probes of a redis found unreachable, logs go to the spool file meanwhile
+SPOOL_RETRY_INTERVAL = 1.0
+
+# seconds to wait for a connection to redis, and for the answer to a command (server side queries included)
+REDIS_CONNECT_TIMEOUT = 1.0
+REDIS_TIMEOUT = 5.0
+# seconds the background probe of an unreachable redis waits for the connection and the answer to PING
+REDIS_PROBE_TIMEOUT = 0.5
+
+# entries a server side query reads per script call, redis answers no other client while a script runs
+QUERY_WINDOW = 20000
+
+# redis connection pools shared by every RedisBackend of the process, by (host, port, unix socket)
+_redis_pools = {}
+_redis_pools_lock = threading.Lock()
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+EPOCH = datetime(1970, 1, 1)
+
+# epoch seconds of midnight by "YYYY-mm-dd" prefix, so text timestamps are parsed without strptime
+_day_epochs = {}
+
+# binary records: BINARY_MAGIC, payload length, then epoch seconds, log_type code and sub_type code,
+# inline (length prefixed) log_type / sub_type when their code is 0, and the description as the remainder.
+# Text lines never start with BINARY_MAGIC, so both formats can share a redis list or a log file.
+BINARY_MAGIC = b"\x00"
+BINARY_LENGTH = struct.Struct(">I")
+BINARY_HEADER = struct.Struct(">qBB")
+BINARY_STRING = struct.Struct(">H")
+LOG_TYPES = ("ERROR", "WARNING", "SUCCESS", "INFO", "DEBUG")
+SUB_TYPES = ("ACCESS", "WRITE", "READ", "EDIT", "DELETE")
+LOG_TYPE_CODES = dict((log_type, code + 1) for code, log_type in enumerate(LOG_TYPES))
+SUB_TYPE_CODES = dict((sub_type, code + 1) for code, sub_type in enumerate(SUB_TYPES))
+
+# filter()/count() evaluated inside redis over a window of the list, read in chunks; returns the count or the
+# matching records. KEYS[1]: namespace list, ARGV: date_from, date_to (epoch seconds, "" for unbounded), log_type,
+# sub_type, description, "1" to only count, first and last LRANGE index of the window
+QUERY_SCRIPT = """
+local date_from = tonumber(ARGV[1]) or -math.huge
+local date_to = tonumber(ARGV[2]) or math.huge
+local log_type, sub_type, description = ARGV[3], ARGV[4], ARGV[5]
+local count_only = ARGV[6] == "1"
+local log_types = {"ERROR", "WARNING", "SUCCESS", "INFO", "DEBUG"}
+local sub_types = {"ACCESS", "WRITE", "READ", "EDIT", "DELETE"}
+
+local function epoch(stamp)
+    local year, month = tonumber(stamp:sub(1, 4)), tonumber(stamp:sub(6, 7))
+    if not year or not month then return nil end
+    if month <= 2 then year = year - 1 end
+    local era = math.floor(year / 400)
+    local year_of_era = year - era * 400
+    local day_of_year = math.floor((153 * ((month + 9) % 12) + 2) / 5) + tonumber(stamp:sub(9, 10)) - 1
+    local day_of_era = year_of_era * 365 + math.floor(year_of_era / 4) - math.floor(year_of_era / 100) + day_of_year
+    return (era * 146097 + day_of_era - 719468) * 86400 + tonumber(stamp:sub(12, 13)) * 3600 +
+        tonumber(stamp:sub(15, 16)) * 60 + tonumber(stamp:sub(18, 19))
+end
+
+local function inline(record, offset)
+    local size
+    size, offset = struct.unpack(">H", record, offset)
+    return record:sub(offset, offset + size - 1), offset + size
+end
+
+local function parse(record)
+    if record:byte(1) == 0 then
+        local log_time, type_code, sub_code, offset = struct.unpack(">lBB", record, 6)
+        local record_type, record_sub_type
+        if type_code > 0 then record_type = log_types[type_code] else record_type, offset = inline(record, offset) end
+        if sub_code > 0 then record_sub_type = sub_types[sub_code] else record_sub_type, offset = inline(record, offset) end
+        return log_time, record_type, record_sub_type, record:sub(offset)
+    end
+    local type_at = record:find(" >< ", 1, true)
+    if not type_at then return nil end
+    local sub_type_at = record:find(" :: ", type_at + 4, true)
+    if not sub_type_at then return nil end
+    local description_at = record:find(" || ", sub_type_at + 4, true)
+    if not description_at then return nil end
+    return epoch(record:sub(1, type_at - 1)), record:sub(type_at + 4, sub_type_at - 1),
+        record:sub(sub_type_at + 4, description_at - 1), record:sub(description_at + 4)
+end
+
+local matched, records = 0, {}
+local start, stop = tonumber(ARGV[7]), tonumber(ARGV[8])
+while start <= stop do
+    local chunk = redis.call("LRANGE", KEYS[1], start, math.min(start + 999, stop))
+    if #chunk == 0 then break end
+    for _, record in ipairs(chunk) do
+        local ok, log_time, record_type, record_sub_type, record_description = pcall(parse, record)
+        if ok and log_time and date_from < log_time and log_time < date_to and
+                record_type:find(log_type, 1, true) and record_sub_type:find(sub_type, 1, true) and
+                record_description:find(description, 1, true) then
+            matched = matched + 1
+            if not count_only then records[matched] = record end
+        end
+    end
+    start = start + 1000
+end
+if count_only then return matched end
+return records
+"""
+
+# count() without description filter from the rollup hashes of a list, see _Rollup: whole hours from the hour hash,
+# HMGET of the minutes, and then the seconds, of the hours the date range cuts through
+# KEYS[1]: namespace list, KEYS[2..4]: its hour, minute and second hashes, ARGV: date_from, date_to (epoch seconds,
+# "" for unbounded), log_type, sub_type; returns -1 unless the hashes count every log of the list
+ROLLUP_SCRIPT = """
+local date_from = tonumber(ARGV[1]) or -math.huge
+local date_to = tonumber(ARGV[2]) or math.huge
+local sizes = {3600, 60, 1}
+
+local function bucket(level, log_type, sub_type, start, count)
+    local finish = start + sizes[level] - 1
+    if finish <= date_from or start >= date_to then return 0 end
+    if date_from < start and finish < date_to then return count end
+    local fields, starts = {}, {}
+    for second = start, finish, sizes[level + 1] do
+        starts[#starts + 1] = second
+        fields[#fields + 1] = log_type .. "\\031" .. sub_type .. "\\031" .. string.format("%d", second)
+    end
+    local total = 0
+    for i, finer in ipairs(redis.call("HMGET", KEYS[level + 2], unpack(fields))) do
+        if finer then total = total + bucket(level + 1, log_type, sub_type, starts[i], tonumber(finer)) end
+    end
+    return total
+end
+
+local hours = redis.call("HGETALL", KEYS[2])
+local entries, total = 0, 0
+for i = 1, #hours, 2 do
+    if hours[i] == "entries" then
+        entries = tonumber(hours[i + 1])
+    else
+        local log_type, sub_type, start = hours[i]:match("^(.*)\\031(.*)\\031(-?%d+)$")
+        if log_type:find(ARGV[3], 1, true) and sub_type:find(ARGV[4], 1, true) then
+            total = total + bucket(1, log_type, sub_type, tonumber(start), tonumber(hours[i + 1]))
+        end
+    end
+end
+if entries ~= redis.call("LLEN", KEYS[1]) then return -1 end
+return total
+"""
+
+
+def _redis_busy(error):
+    """
+    :param error: redis ResponseError
+    :return: True if redis refused the command because a script ran past lua-time-limit, like an unreachable server
+    """
+    message = str(error)
+    return message.startswith("BUSY ") or "caused error: BUSY " in message
+
+
+def _to_epoch(log_time):
+    """
+    Seconds since EPOCH for a naive datetime, the unit LogIndex keeps timestamps in
+    """
+    return (log_time - EPOCH).total_seconds()
+
+
+def _parse_time(log_time):
+    """
+    Epoch seconds of a TIME_FORMAT timestamp, read from its fixed width fields
+    The date is converted once per day and cached; anything not shaped like TIME_FORMAT goes through strptime
+    :raises ValueError: on a malformed timestamp
+    """
+    clock = log_time[11:13] + log_time[14:16] + log_time[17:19]
+    if len(log_time) != 20 or log_time[10] != "T" or log_time[13] != ":" or log_time[16] != ":" \
+            or log_time[19] != "Z" or not clock.isdigit() or clock[:2] > "23" or clock[2:4] > "59" \
+            or clock[4:] > "59":
+        return _to_epoch(datetime.strptime(log_time, TIME_FORMAT))
+    day = _day_epochs.get(log_time[:10])
+    if day is None:
+        day = _to_epoch(datetime.strptime(log_time[:10], "%Y-%m-%d"))
+        if len(_day_epochs) < 100000:
+            _day_epochs[log_time[:10]] = day
+    return day + int(clock[:2]) * 3600 + int(clock[2:4]) * 60 + int(clock[4:])
+
+
+def _parse_line(line):
+    """
+    Split a "time >< log_type :: sub_type || description" line into its fields
+    :param line: a log line as stored in redis or the log file
+    :return: (epoch seconds, log_type, sub_type, description)
+    :raises ValueError: on a malformed line
+    """
+    log_time, rest = _text(line).rstrip("\n").split(" >< ", 1)
+    log_type, rest = rest.split(" :: ", 1)
+    sub_type, description = rest.split(" || ", 1)
+    return _parse_time(log_time), log_type, sub_type, description
+
+
+def _utf8(value):
+    """
+    :return: value as UTF-8 encoded bytes
+    """
+    return value if isinstance(value, bytes) else value.encode("utf-8")
+
+
+def _text(value):
+    """
+    Records are stored and read back as bytes, their fields are parsed into native strings
+    :return: value as str, decoded from UTF-8 on Python 3
+    """
+    return value.decode("utf-8") if str is not bytes and isinstance(value, bytes) else value
+
+
+def _format_binary(log_time, log_type, sub_type, description):
+    """
+    Encode a log as a binary record
+    Text fields are framed as UTF-8 bytes, so unicode values get length prefixes counted in bytes
+    :param log_time: epoch seconds
+    :return: record string
+    """
+    type_code = LOG_TYPE_CODES.get(log_type, 0)
+    sub_code = SUB_TYPE_CODES.get(sub_type, 0)
+    log_type, sub_type, description = _utf8(log_type), _utf8(sub_type), _utf8(description)
+    parts = [BINARY_HEADER.pack(int(log_time), type_code, sub_code)]
+    if not type_code:
+        parts.extend((BINARY_STRING.pack(len(log_type)), log_type))
+    if not sub_code:
+        parts.extend((BINARY_STRING.pack(len(sub_type)), sub_type))
+    parts.append(description)
+    payload = b"".join(parts)
+    return b"".join((BINARY_MAGIC, BINARY_LENGTH.pack(len(payload)), payload))
+
+
+def _parse_binary(record):
+    """
+    Decode a binary record
+    :param record: record string starting with BINARY_MAGIC
+    :return: (epoch seconds, log_type, sub_type, description)
+    :raises ValueError: on a malformed record
+    """
+    try:
+        offset = 1 + BINARY_LENGTH.size
+        log_time, type_code, sub_code = BINARY_HEADER.unpack_from(record, offset)
+        offset += BINARY_HEADER.size
+        if type_code:
+            log_type = LOG_TYPES[type_code - 1]
+        else:
+            size = BINARY_STRING.unpack_from(record, offset)[0]
+            offset += BINARY_STRING.size
+            log_type = record[offset:offset + size]
+            offset += size
+        if sub_code:
+            sub_type = SUB_TYPES[sub_code - 1]
+        else:
+            size = BINARY_STRING.unpack_from(record, offset)[0]
+            offset += BINARY_STRING.size
+            sub_type = record[offset:offset + size]
+            offset += size
+    except (struct.error, IndexError):
+        raise ValueError("Malformed binary log record")
+    return float(log_time), _text(log_type), _text(sub_type), _text(record[offset:])
+
+
+def _parse_record(record):
+    """
+    Parse a log record in either the text or the binary format
+    :return: (epoch seconds, log_type, sub_type, description)
+    :raises ValueError: on a malformed record
+    """
+    if record[:1] == BINARY_MAGIC:
+        return _parse_binary(record)
+    return _parse_line(record)
+
+
+def _iter_records(lines):
+    """
+    Group raw lines into log records
+    A text record is one line; a binary record is put back together across the newline bytes its payload may
+    contain. An incomplete record at the end (still being written) is left out.
+    :param lines: iterable of lines, newline included
+    :return: generator of records without the trailing newline
+    """
+    lines = iter(lines)
+    for line in lines:
+        if line[:1] == BINARY_MAGIC:
+            try:
+                while len(line) < 1 + BINARY_LENGTH.size:
+                    line += next(lines)
+                size = 2 + BINARY_LENGTH.size + BINARY_LENGTH.unpack_from(line, 1)[0]
+                while len(line) < size:
+                    line += next(lines)
+            except StopIteration:
+                return
+            yield line[:size - 1]
+        elif line.endswith(b"\n"):
+            yield line[:-1]
+
+
+class LogIndex(object):
+    """
+    Columnar store of parsed logs backing filter() and count()
+    Rows are kept sorted by time, so a date range is two bisects over the times array.
+    (log_type, sub_type) pairs are dictionary encoded into small ints, each with a posting
+    list of its row numbers, so type filters only touch the matching rows.
+    """
+    def __init__(self):
+        self.times = array('d')
+        self.pair_codes = array('i')
+        self.descriptions = []
+        self.pair_values = []
+        self.pair_lookup = {}
+        self.postings = []
+
+    def __len__(self):
+        return len(self.times)
+
+    def _append(self, log_time, log_type, sub_type, description):
+        pair = (log_type, sub_type)
+        code = self.pair_lookup.get(pair)
+        if code is None:
+            code = self.pair_lookup[pair] = len(self.pair_values)
+            self.pair_values.append(pair)
+            self.postings.append(array('i'))
+        self.postings[code].append(len(self.times))
+        self.times.append(log_time)
+        self.pair_codes.append(code)
+        self.descriptions.append(description)
+
+    def rows(self):
+        """
+        Iterate over the stored logs in time order
+        :return: generator of (epoch seconds, log_type, sub_type, description)
+        """
+        for row in range(len(self.times)):
+            log_type, sub_type = self.pair_values[self.pair_codes[row]]
+            yield self.times[row], log_type, sub_type, self.descriptions[row]
+
+    def extend(self, entries):
+        """
+        Add parsed logs to the index
+        Entries newer than everything indexed are appended; older ones trigger a re-sort of the store
+        :param entries: iterable of (epoch seconds, log_type, sub_type, description)
+        :return: None
+        """
+        entries = sorted(entries, key=lambda entry: entry[0])
+        if not entries:
+            return
+        if self.times and entries[0][0] < self.times[-1]:
+            entries = sorted(list(self.rows()) + entries, key=lambda entry: entry[0])
+            self.__init__()
+        for entry in entries:
+            self._append(*entry)
+
+    def _matches(self, date_from, date_to, log_type, sub_type):
+        """
+        Posting list slices matching the query
+        :return: list of (posting list, start, end)
+        """
+        first = bisect_right(self.times, date_from)
+        last = bisect_left(self.times, date_to)
+        matches = []
+        if first >= last:
+            return matches
+        for code, (pair_type, pair_sub_type) in enumerate(self.pair_values):
+            if log_type in pair_type and sub_type in pair_sub_type:
+                posting = self.postings[code]
+                matches.append((posting, bisect_left(posting, first), bisect_left(posting, last)))
+        return matches
+
+    def count(self, date_from, date_to, log_type="", sub_type="", description=""):
+        """
+        Number of logs with date_from < time < date_to whose fields contain the given strings
+        :param date_from: epoch seconds
+        :param date_to: epoch seconds
+        :return: int
+        """
+        total = 0
+        for posting, start, end in self._matches(date_from, date_to, log_type, sub_type):
+            if description:
+                descriptions = self.descriptions
+                total += sum(1 for row in posting[start:end] if description in descriptions[row])
+            else:
+                total += end - start
+        return total
+
+    def filter(self, date_from, date_to, log_type="", sub_type="", description=""):
+        """
+        Logs with date_from < time < date_to whose fields contain the given strings
+        :param date_from: epoch seconds
+        :param date_to: epoch seconds
+        :return: list of [datetime, log_type, sub_type, description] in time order
+        """
+        rows = []
+        for posting, start, end in self._matches(date_from, date_to, log_type, sub_type):
+            rows.extend(posting[start:end])
+        rows.sort()
+        filter_query = []
+        for row in rows:
+            if description in self.descriptions[row]:
+                log_type, sub_type = self.pair_values[self.pair_codes[row]]
+                filter_query.append([EPOCH + timedelta(seconds=self.times[row]), log_type, sub_type,
+                                     self.descriptions[row]])
+        return filter_query
+
+
+def _open_append(path):
+    """
+    Open the live log file for appending, holding an exclusive flock until it is closed
+    A file that was rotated away while waiting for the lock is closed and the new live file opened instead,
+    so no record lands in a segment that is being sealed.
+    :param path: path of the live log file
+    :return: file object
+    """
+    while 1:
+        file_instance = open(path, "ab")
+        if fcntl is None:
+            return file_instance
+        fcntl.flock(file_instance.fileno(), fcntl.LOCK_EX)
+        try:
+            if os.fstat(file_instance.fileno()).st_ino == os.stat(path).st_ino:
+                return file_instance
+        except OSError:
+            pass
+        file_instance.close()
+
+
+def _iter_segment(path):
+    """
+    Stream the records of a log file, transparently decompressing .gz segments
+    :param path: path to a .log or .log.gz file
+    :return: generator of records
+    """
+    segment = gzip.open(path, 'rb') if path.endswith(".gz") else open(path, 'rb')
+    with segment:
+        for record in _iter_records(segment):
+            yield record
+
+
+def _meta_add(meta, record):
+    """
+    Account for one log record in a segment sidecar
+    :param meta: sidecar dict with min/max epoch seconds, count and counts per log_type and sub_type
+    :param record: log record
+    :return: None
+    """
+    try:
+        log_time, log_type, sub_type = _parse_record(record)[:3]
+    except ValueError:
+        return
+    if not meta["count"]:
+        meta["min"] = meta["max"] = log_time
+    meta["min"] = min(meta["min"], log_time)
+    meta["max"] = max(meta["max"], log_time)
+    meta["count"] += 1
+    sub_types = meta["counts"].setdefault(log_type, {})
+    sub_types[sub_type] = sub_types.get(sub_type, 0) + 1
+
+
+def _write_meta(segment, meta):
+    """
+    Save the sidecar of a rotated segment as <segment>.meta
+    Empty segments are not recorded, they may be a name claimed for a rotation still in progress
+    """
+    if not meta["count"]:
+        return
+    with open("%s.meta" % segment, 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+
+def _segment_meta(segment):
+    """
+    Min/max timestamp of a rotated segment, from its sidecar or computed and saved on first use
+    :param segment: uncompressed segment path (<name>_N.log), <segment>.gz is read if it is what exists
+    :return: dict with min and max epoch seconds, count of logs and counts per log_type and sub_type
+    """
+    try:
+        with open("%s.meta" % segment) as meta_file:
+            return json.load(meta_file)
+    except (IOError, ValueError):
+        pass
+    meta = {"min": None, "max": None, "count": 0, "counts": {}}
+    path = segment if os.path.isfile(segment) else "%s.gz" % segment
+    try:
+        for record in _iter_segment(path):
+            _meta_add(meta, record)
+    except IOError:
+        return meta
+    _write_meta(segment, meta)
+    return meta
+
+
+def _seal_segment(segment, level=None):
+    """
+    Finish a rotated segment: write its min/max timestamp sidecar and, with a level, gzip it to <segment>.gz
+    Compression goes to a temporary name first so a half written archive is never picked up as a segment
+    :param segment: path of the rotated, uncompressed segment
+    :param level: gzip compression level 1-9, None to leave the segment uncompressed
+    :return: None
+    """
+    meta = {"min": None, "max": None, "count": 0, "counts": {}}
+    temp_name = "%s.gz.tmp" % segment
+    f_out = gzip.open(temp_name, 'wb', level) if level else None
+    with open(segment, 'rb') as f_in:
+        for record in _iter_records(f_in):
+            _meta_add(meta, record)
+            if f_out is not None:
+                f_out.write(record)
+                f_out.write(b"\n")
+    _write_meta(segment, meta)
+    if f_out is not None:
+        f_out.close()
+        os.rename(temp_name, "%s.gz" % segment)
+        os.remove(segment)
+
+
+def _query_records(records, date_from, date_to, log_type="", sub_type="", description="", count_only=False,
+                   raw=False):
+    """
+    Apply a filter()/count() query to a stream of log records
+    :param records: iterable of text or binary log records
+    :param date_from: epoch seconds
+    :param date_to: epoch seconds
+    :param count_only: return the number of matches instead of the rows
+    :param raw: return the matching records themselves instead of parsed rows
+    :return: int if count_only, else list of [datetime, log_type, sub_type, description] (or records if raw)
+    """
+    matched = 0
+    filter_query = []
+    for record in records:
+        try:
+            log_time, log_type_re, sub_type_re, description_re = _parse_record(record)
+        except ValueError:
+            continue
+        if date_from < log_time < date_to and log_type in log_type_re and sub_type in sub_type_re \
+                and description in description_re:
+            if count_only:
+                matched += 1
+            elif raw:
+                filter_query.append(record)
+            else:
+                filter_query.append([EPOCH + timedelta(seconds=log_time), log_type_re, sub_type_re, description_re])
+    return matched if count_only else filter_query
+
+
+def _scan_segment(path, date_from, date_to, log_type="", sub_type="", description="", count_only=False):
+    """
+    Stream one log file and apply a filter()/count() query to it
+    :param path: path to a .log or .log.gz file
+    :return: int if count_only, else list of [datetime, log_type, sub_type, description]
+    """
+    try:
+        return _query_records(_iter_segment(path), date_from, date_to, log_type, sub_type, description, count_only)
+    except IOError:
+        # segment was compressed or rotated away while listing
+        return 0 if count_only else []
+
+
+def _rollup(records, keys=None):
+    """
+    Count log records per log_type, sub_type and second
+    :param records: iterable of text or binary log records
+    :param keys: (log_type, sub_type, epoch second) of every record, parsed from the records when not given
+    :return: dict of (log_type, sub_type, epoch second) -> count
+    """
+    if keys is None:
+        keys = _rollup_keys(records)
+    rollup = {}
+    for key in keys:
+        rollup[key] = rollup.get(key, 0) + 1
+    return rollup
+
+
+def _rollup_keys(records):
+    """
+    :return: iterator of (log_type, sub_type, epoch second) of the well formed records
+    """
+    for record in records:
+        try:
+            log_time, log_type, sub_type = _parse_record(record)[:3]
+        except ValueError:
+            continue
+        yield log_type, sub_type, int(log_time)
+
+
+class _Rollup(object):
+    """
+    Counters of logs per log_type, sub_type and hour, minute and second bucket
+    count() adds up whole hours and only looks at the minutes, and then the seconds, of the hours the date range
+    cuts through, so it costs O(hours) rather than O(seconds)
+    """
+    # bucket sizes in seconds, coarsest first
+    BUCKETS = (3600, 60, 1)
+
+    def __init__(self, rollup=None):
+        """
+        :param rollup: dict of (log_type, sub_type, epoch second) -> count to start with
+        """
+        self.counts = tuple({} for _ in self.BUCKETS)
+        if rollup:
+            self.add(rollup)
+
+    def add(self, rollup):
+        """
+        :param rollup: dict of (log_type, sub_type, epoch second) -> count
+        :return: None
+        """
+        for size, counts in zip(self.BUCKETS, self.counts):
+            for (log_type, sub_type, second), count in rollup.items():
+                key = (log_type, sub_type, second - second % size)
+                counts[key] = counts.get(key, 0) + count
+
+    def seconds(self):
+        """
+        :return: dict of (log_type, sub_type, epoch second) -> count
+        """
+        return dict(self.counts[-1])
+
+    def count(self, date_from, date_to, log_type="", sub_type=""):
+        """
+        Answer a count() without description filter
+        :param date_from: epoch seconds
+        :param date_to: epoch seconds
+        :return: int
+        """
+        return sum(self._bucket(0, key, count, date_from, date_to) for key, count in self.counts[0].items()
+                   if log_type in key[0] and sub_type in key[1])
+
+    def _bucket(self, level, key, count, date_from, date_to):
+        """
+        :return: how many of the count logs of a bucket lie inside the date range
+        """
+        log_type, sub_type, start = key
+        end = start + self.BUCKETS[level] - 1
+        if end <= date_from or start >= date_to:
+            return 0
+        if date_from < start and end < date_to:
+            return count
+        # an edge bucket, cut by the date range: add up its finer buckets
+        size, counts = self.BUCKETS[level + 1], self.counts[level + 1]
+        total = 0
+        for second in range(start, end + 1, size):
+            finer = counts.get((log_type, sub_type, second))
+            if finer:
+                total += self._bucket(level + 1, (log_type, sub_type, second), finer, date_from, date_to)
+        return total
+
+
+def _rollup_hashes(key):
+    """
+    :param key: redis list the rollup counters belong to
+    :return: names of its rollup hashes by _Rollup.BUCKETS, hours (with the "entries" field), minutes and seconds
+    """
+    return ["%s:rollup" % key, "%s:rollup:minutes" % key, "%s:rollup:seconds" % key]
+
+
+def _rollup_fields(entries, fields, length):
+    """
+    Decode the fields of a redis rollup hash, "<log_type>\x1f<sub_type>\x1f<epoch second>" -> count
+    :param entries: "entries" field of the hour hash, the number of logs the hashes account for
+    :param length: number of logs in the list the hash belongs to
+    :return: dict of (log_type, sub_type, epoch second) -> count, None unless the hash counts every log of the list
+    """
+    if int(entries or 0) != length:
+        # logs pushed without counters, or before counting started
+        return None
+    rollup = {}
+    for field, count in fields.items():
+        log_type, sub_type, second = field.split(b"\x1f")
+        rollup[(_text(log_type), _text(sub_type), int(second))] = int(count)
+    return rollup
+
+
+def _rollup_path(path):
+    """
+    :param path: live log file or segment (.log or .log.gz)
+    :return: path of its rollup sidecar
+    """
+    return "%s.rollup" % (path[:-3] if path.endswith(".gz") else path)
+
+
+def _append_rollup(path, rollup):
+    """
+    Add the counters of logs just written to a log file to its rollup sidecar, one JSON line per flush
+    :param path: live log file
+    :param rollup: dict of (log_type, sub_type, epoch second) -> count, None when logs were written uncounted,
+        which leaves the sidecar incomplete for good
+    :return: None
+    """
+    rows = None if rollup is None else [[log_type, sub_type, second, count]
+                                        for (log_type, sub_type, second), count in rollup.items()]
+    with open(_rollup_path(path), "a") as rollup_file:
+        rollup_file.write("%s\n" % json.dumps(rows))
+
+
+def _read_rollup(path, cached=None):
+    """
+    Counters of every log in a live log file or segment, from its rollup sidecar
+    :param path: live log file or segment (.log or .log.gz)
+    :param cached: what an earlier call returned for the same path, only the lines added since are read
+    :return: (inode, offset read up to, _Rollup or None if the sidecar is incomplete), None without a sidecar
+    """
+    try:
+        with open(_rollup_path(path), "rb") as rollup_file:
+            stat = os.fstat(rollup_file.fileno())
+            if cached is None or cached[0] != stat.st_ino or cached[1] > stat.st_size:
+                cached = (stat.st_ino, 0, _Rollup())
+            inode, offset, rollup = cached
+            if rollup is None:
+                return cached
+            rollup_file.seek(offset)
+            data = rollup_file.read()
+    except (IOError, OSError):
+        return None
+    # leave out a line still being written
+    data = data[:data.rfind(b"\n") + 1]
+    try:
+        lines = [json.loads(line.decode("utf-8")) for line in data.splitlines()]
+    except ValueError:
+        return None
+    if None in lines:
+        return inode, offset + len(data), None
+    for rows in lines:
+        rollup.add(dict(((log_type, sub_type, second), count) for log_type, sub_type, second, count in rows))
+    return inode, offset + len(data), rollup
+
+
+class LogBackend(object):
+    """
+    Storage interface Logist writes to and reads from
+    Entries behave like a redis list with the newest entry at the head. A generation number changes
+    whenever entries are removed or put back, so readers can tell plain appends from rewrites.
+    With rollups set, a backend keeps count of its entries per log_type, sub_type and hour, minute and second,
+    see rollup_count().
+    """
+    rollups = False
+    # most entries kept before the oldest are dropped, None when unbounded
+    capacity = None
+
+    def push(self, entries, keys=None):
+        """
+        Add entries, oldest first, in front of the stored ones
+        :param keys: (log_type, sub_type, epoch second) of every entry for the rollup counters, saves parsing them
+        :return: number of stored entries
+        """
+        raise NotImplementedError
+
+    def length(self):
+        """
+        :return: number of stored entries
+        """
+        raise NotImplementedError
+
+    def trim(self, count):
+        """
+        Drop all but the newest count entries
+        """
+        raise NotImplementedError
+
+    def detach(self):
+        """
+        Atomically take all stored entries out, new pushes start an empty store
+        :return: handle for read()/release(), None if there was nothing stored
+        """
+        raise NotImplementedError
+
+    def read(self, handle, count):
+        """
+        :return: up to count entries from the head of a detached batch
+        """
+        raise NotImplementedError
+
+    def release(self, handle, count, restore=None):
+        """
+        Drop count entries from the head of a detached batch and, in the same step, put the
+        restore entries back at the tail of the store (they are older than anything pushed since)
+        """
+        raise NotImplementedError
+
+    def detached_rollup(self, handle):
+        """
+        Counters of the entries of a detached batch, handed over once, see rollup_counts()
+        :return: dict of (log_type, sub_type, epoch second) -> count, None if not maintained or no longer exact
+        """
+        return None
+
+    def orphans(self):
+        """
+        Detached batches left behind by a flush or export that died half way, taken over by the caller
+        :return: list of handles for read()/release()
+        """
+        return []
+
+    def read_new(self, indexed=0):
+        """
+        Entries stored on top of the oldest indexed ones
+        :return: (generation, entries newest first)
+        """
+        raise NotImplementedError
+
+    def query(self, date_from, date_to, log_type="", sub_type="", description="", count_only=False):
+        """
+        filter()/count() over the stored entries
+        :return: int if count_only, else list of matching records
+        """
+        return _query_records(self.read_new()[1], date_from, date_to, log_type, sub_type, description, count_only,
+                              raw=True)
+
+    def rollup_counts(self):
+        """
+        Counters of the stored entries, kept up to date by push(), detach() and release()
+        :return: dict of (log_type, sub_type, epoch second) -> count, None if not maintained or no longer exact
+        """
+        return None
+
+    def rollup_count(self, date_from, date_to, log_type="", sub_type=""):
+        """
+        count() without description filter over the stored entries, from the rollup counters
+        :param date_from: epoch seconds
+        :param date_to: epoch seconds
+        :return: int, None if the counters are not maintained or no longer exact
+        """
+        return None
+
+    def shards(self):
+        """
+        :return: the stores flushed and indexed one by one
+        """
+        return [self]
+
+    def route(self, entries, keys=None):
+        """
+        Split entries, and their rollup keys if given, by the store they are pushed to
+        :return: list of (store, entries, keys)
+        """
+        return [(self, entries, keys)]
+
+
+def _redis_pool(host, port, unix_socket=""):
+    """
+    Connection pool shared by every RedisBackend of the process talking to the same server
+    :param unix_socket: path of a local redis unix socket, used instead of host and port when given
+    :return: redis ConnectionPool
+    """
+    key = (host, port, unix_socket)
+    with _redis_pools_lock:
+        if key not in _redis_pools:
+            if unix_socket:
+                _redis_pools[key] = ConnectionPool(connection_class=UnixDomainSocketConnection, path=unix_socket,
+                                                   socket_timeout=REDIS_TIMEOUT, **_redis_options)
+            else:
+                _redis_pools[key] = ConnectionPool(host=host, port=port, socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+                                                   socket_timeout=REDIS_TIMEOUT, **_redis_options)
+        return _redis_pools[key]
+
+
+class RedisBackend(LogBackend):
+    """
+    Stores logs in the redis list NAMESPACE, removals bump the NAMESPACE:generation counter
+    With a spool_path, logs go to that file until a background probe finds redis answering, at start and
+    whenever a push finds redis unreachable, busy or without an answer within REDIS_TIMEOUT. The probe pings
+    every SPOOL_RETRY_INTERVAL seconds with a short timeout and replays the spool in bulk ahead of new logs,
+    so callers never wait on a redis that is down.
+    """
+    def __init__(self, namespace="DEFAULT", host="localhost", port=6379, unix_socket="", spool_path=""):
+        if Redis is None:
+            raise ImportError("Redis is not Installed")
+        self.namespace = namespace
+        self.generation_key = "%s:generation" % namespace
+        self.rollup_keys = _rollup_hashes(namespace)
+        self.rollup_key = self.rollup_keys[0]
+        self.orphans_checked = 0
+        self.redis_instance = Redis(connection_pool=_redis_pool(host, port, unix_socket))
+        # sent with EVALSHA, falling back to loading the script once per redis server
+        self.query_script = self.redis_instance.register_script(QUERY_SCRIPT)
+        self.rollup_script = self.redis_instance.register_script(ROLLUP_SCRIPT)
+        # a connection of its own with a short timeout, to check on redis without waiting REDIS_TIMEOUT
+        self.probe_instance = Redis(host=host, port=port, unix_socket_path=unix_socket or None,
+                                    socket_timeout=REDIS_PROBE_TIMEOUT, socket_connect_timeout=REDIS_PROBE_TIMEOUT,
+                                    **_redis_options)
+        self.spool_path = spool_path
+        # logs go to the spool, and a probe thread runs, until redis answered and the spool was replayed
+        self.spooling = False
+        self.probe_thread = None
+        self.spool_lock = threading.Lock()
+        available = False
+        try:
+            available = self.probe_instance.ping()
+        except REDIS_UNAVAILABLE:
+            print("Not able to connect to redis.\nPlease install/start redis before proceeding.")
+        except ResponseError as error:
+            if not _redis_busy(error):
+                raise
+            print("Redis is busy running a script.")
+        if spool_path and (not available or os.path.isfile(spool_path)):
+            # the probe thread replays the spool left by an earlier run, or waits for redis
+            with self.spool_lock:
+                self._start_probe()
+
+    def push(self, entries, keys=None):
+        if not self.spool_path:
+            return self._lpush(entries, keys)
+        with self.spool_lock:
+            spooling = self.spooling
+            if spooling:
+                self._spool(entries)
+        if spooling:
+            return 0
+        try:
+            return self._lpush(entries, keys)
+        except REDIS_UNAVAILABLE:
+            pass
+        except ResponseError as error:
+            if not _redis_busy(error):
+                raise
+        with self.spool_lock:
+            self._spool(entries)
+            self._start_probe()
+        return 0
+
+    def _start_probe(self):
+        """
+        Send logs to the spool from now on and start the probe thread, called with the spool lock held
+        :return: None
+        """
+        self.spooling = True
+        if self.probe_thread is None:
+            self.probe_thread = threading.Thread(target=self._probe, name="logist-redis-probe")
+            self.probe_thread.daemon = True
+            self.probe_thread.start()
+
+    def _probe(self):
+        """
+        Probe thread: PING redis until it answers, then replay the spool; logs pushed meanwhile are spooled
+        and replayed as well, and once the spool is empty pushes go to redis again
+        :return: None
+        """
+        wait = 0
+        while 1:
+            time.sleep(wait)
+            wait = SPOOL_RETRY_INTERVAL
+            try:
+                self.probe_instance.ping()
+                self._replay()
+            except REDIS_UNAVAILABLE + (ResponseError,):
+                continue
+            with self.spool_lock:
+                if os.path.isfile(self.spool_path):
+                    # spooled during the replay, replay again right away
+                    wait = 0
+                    continue
+                self.spooling = False
+                self.probe_thread = None
+                return
+
+    def _lpush(self, entries, keys=None):
+        """
+        LPUSH entries with, if rollups are kept, the HINCRBYs of the rollup hashes in the same transaction
+        :param keys: rollup keys of the entries, parsed from them when not given
+        :return: list length
+        """
+        if not self.rollups:
+            return self.redis_instance.lpush(self.namespace, *entries)
+        pipe = self.redis_instance.pipeline()
+        pipe.lpush(self.namespace, *entries)
+        self._rollup_incr(pipe, entries, keys)
+        return pipe.execute()[0]
+
+    def _rollup_incr(self, pipe, entries, keys=None):
+        """
+        Count entries in the NAMESPACE:rollup hashes of hours, minutes and seconds, fields
+        "<log_type>\x1f<sub_type>\x1f<bucket start>"; the "entries" field of the hour hash counts the logs
+        accounted for, the hashes are only trusted while that matches the list length
+        :param pipe: redis pipeline the HINCRBYs are added to
+        :return: None
+        """
+        pipe.hincrby(self.rollup_key, "entries", len(entries))
+        for rollup_key, counts in zip(self.rollup_keys, _Rollup(_rollup(entries, keys)).counts):
+            for (log_type, sub_type, start), count in counts.items():
+                pipe.hincrby(rollup_key, "%s\x1f%s\x1f%d" % (log_type, sub_type, start), count)
+
+    def _spool(self, entries):
+        """
+        Append entries, oldest first, to the spool file, called with the spool lock held
+        """
+        with open(self.spool_path, "ab") as spool_file:
+            spool_file.write(b"".join(entry + b"\n" for entry in entries))
+
+    def _replay(self):
+        """
+        Push the spool file to redis in FLUSH_CHUNK_SIZE chunks
+        The spool is renamed first, so concurrent writers start a new one and no entry is replayed twice;
+        whatever could not be pushed goes back to the spool.
+        """
+        with self.spool_lock:
+            replay_path = "%s.%s" % (self.spool_path, uuid.uuid4().hex)
+            try:
+                os.rename(self.spool_path, replay_path)
+            except OSError:
+                return
+        chunk = []
+        records = _iter_segment(replay_path)
+        try:
+            for record in records:
+                chunk.append(record)
+                if len(chunk) == FLUSH_CHUNK_SIZE:
+                    self._lpush(chunk)
+                    chunk = []
+            if chunk:
+                self._lpush(chunk)
+        except REDIS_UNAVAILABLE + (ResponseError,):
+            with self.spool_lock:
+                self._spool(chunk + list(records))
+            os.remove(replay_path)
+            raise
+        os.remove(replay_path)
+
+    def length(self):
+        return self.redis_instance.llen(self.namespace)
+
+    def trim(self, count):
+        pipe = self.redis_instance.pipeline()
+        pipe.ltrim(self.namespace, 0, count - 1)
+        pipe.incr(self.generation_key)
+        if self.rollups:
+            # the dropped entries are unknown, the counters stay off until the list is detached
+            pipe.delete(*self.rollup_keys)
+        pipe.execute()
+
+    def detach(self):
+        # RENAME to a unique staging key, entries pushed from here on start a fresh list (and rollup counters);
+        # the staging key is leased, a batch whose lease ran out is an orphan any flusher may take over
+        staging_key = "%s:staging:%s" % (self.namespace, uuid.uuid4().hex)
+        pipe = self.redis_instance.pipeline()
+        pipe.rename(self.namespace, staging_key)
+        pipe.incr(self.generation_key)
+        if self.rollups:
+            # the counters go along with the batch, see detached_rollup()
+            for rollup_key, staging_rollup_key in zip(self.rollup_keys, _rollup_hashes(staging_key)):
+                pipe.rename(rollup_key, staging_rollup_key)
+        else:
+            pipe.delete(*self.rollup_keys)
+        pipe.set("%s:lease" % staging_key, 1, ex=STAGING_LEASE)
+        if isinstance(pipe.execute(raise_on_error=False)[0], ResponseError):
+            # list is already gone, another writer took it
+            if self.rollups:
+                self.redis_instance.delete(*_rollup_hashes(staging_key))
+            return None
+        return staging_key
+
+    def read(self, handle, count):
+        return self.redis_instance.lrange(handle, 0, count - 1)
+
+    def release(self, handle, count, restore=None):
+        pipe = self.redis_instance.pipeline()
+        if restore:
+            pipe.rpush(self.namespace, *restore)
+            pipe.incr(self.generation_key)
+            if self.rollups:
+                self._rollup_incr(pipe, restore)
+        pipe.ltrim(handle, count, -1)
+        pipe.expire("%s:lease" % handle, STAGING_LEASE)
+        pipe.execute()
+
+    def orphans(self):
+        # SCAN at most once per STAGING_LEASE, orphans only appear when a flusher died
+        if time.time() - self.orphans_checked < STAGING_LEASE:
+            return []
+        self.orphans_checked = time.time()
+        handles = []
+        for key in self.redis_instance.scan_iter(match="%s:staging:*" % self.namespace, count=1000):
+            if not isinstance(key, str):
+                key = key.decode("utf-8")
+            # the lease and the rollup counters of a batch live next to it under the same prefix
+            if key.endswith((":lease", ":rollup", ":rollup:minutes", ":rollup:seconds")) or \
+                    self.redis_instance.exists("%s:lease" % key):
+                continue
+            if self.redis_instance.type(key) not in ("list", b"list"):
+                continue
+            # claimed by RENAME, when several flushers find the same orphan only one of them gets it
+            staging_key = "%s:staging:%s" % (self.namespace, uuid.uuid4().hex)
+            pipe = self.redis_instance.pipeline()
+            pipe.rename(key, staging_key)
+            pipe.set("%s:lease" % staging_key, 1, ex=STAGING_LEASE)
+            for rollup_key, staging_rollup_key in zip(_rollup_hashes(key), _rollup_hashes(staging_key)):
+                pipe.rename(rollup_key, staging_rollup_key)
+            if isinstance(pipe.execute(raise_on_error=False)[0], ResponseError):
+                continue
+            handles.append(staging_key)
+        return handles
+
+    def read_new(self, indexed=0):
+        # the indexed entries are at the tail, everything in front of them is new
+        pipe = self.redis_instance.pipeline()
+        pipe.get(self.generation_key)
+        pipe.lrange(self.namespace, 0, -(indexed + 1))
+        return tuple(pipe.execute())
+
+    def query(self, date_from, date_to, log_type="", sub_type="", description="", count_only=False):
+        bounds = [repr(date) if abs(date) != float("inf") else "" for date in (date_from, date_to)]
+        args = bounds + [log_type, sub_type, description, 1 if count_only else 0]
+        # QUERY_WINDOW entries per script call, so other clients get served in between; windows are counted from
+        # the tail, where entries stay put while new ones are pushed at the head. A list rewritten half way
+        # (flushed or trimmed) is queried again, a few times at most.
+        for _ in range(3):
+            pipe = self.redis_instance.pipeline()
+            pipe.get(self.generation_key)
+            pipe.llen(self.namespace)
+            generation, length = pipe.execute()
+            results = [self.query_script(keys=[self.namespace],
+                                         args=args + [max(stop - QUERY_WINDOW + 1, -length), stop])
+                       for stop in range(-1, -length - 1, -QUERY_WINDOW)]
+            if self.redis_instance.get(self.generation_key) == generation:
+                break
+        if count_only:
+            return sum(results)
+        return [record for result in results for record in result]
+
+    def rollup_counts(self):
+        if not self.rollups:
+            return None
+        pipe = self.redis_instance.pipeline()
+        pipe.hget(self.rollup_key, "entries")
+        pipe.hgetall(self.rollup_keys[-1])
+        pipe.llen(self.namespace)
+        return _rollup_fields(*pipe.execute())
+
+    def rollup_count(self, date_from, date_to, log_type="", sub_type=""):
+        if not self.rollups:
+            return None
+        bounds = [repr(date) if abs(date) != float("inf") else "" for date in (date_from, date_to)]
+        counted = self.rollup_script(keys=[self.namespace] + self.rollup_keys, args=bounds + [log_type, sub_type])
+        return counted if counted >= 0 else None
+
+    def detached_rollup(self, handle):
+        rollup_keys = _rollup_hashes(handle)
+        pipe = self.redis_instance.pipeline()
+        pipe.hget(rollup_keys[0], "entries")
+        pipe.hgetall(rollup_keys[-1])
+        pipe.llen(handle)
+        pipe.delete(*rollup_keys)
+        return _rollup_fields(*pipe.execute()[:3])
+
+
+class MemoryBackend(LogBackend):
+    """
+    Keeps logs in a bounded in-process deque, no redis server and no network round-trip
+    Once max_entries is reached the oldest entries are dropped, like a ring buffer
+    """
+    def __init__(self, max_entries=1000000):
+        self.entries = deque(maxlen=max_entries)
+        self.capacity = max_entries
+        self.generation = 0
+        self.lock = threading.Lock()
+        # _Rollup, None once entries were dropped without being counted out, or added without being counted
+        self.rollup = _Rollup()
+        # (handle, counters) of the latest detached batch
+        self.detached = None
+
+    def push(self, entries, keys=None):
+        rollup = _rollup(entries, keys) if self.rollups else None
+        with self.lock:
+            if len(self.entries) + len(entries) > self.entries.maxlen:
+                self.generation += 1
+                self.rollup = None
+            self.entries.extendleft(entries)
+            self._rollup_add(rollup)
+            return len(self.entries)
+
+    def _rollup_add(self, rollup):
+        """
+        Add counters of new entries to self.rollup, called with the lock held
+        :param rollup: counters of the entries, None if they were not counted
+        """
+        if rollup is None:
+            self.rollup = None
+        if self.rollup is not None:
+            self.rollup.add(rollup)
+
+    def length(self):
+        return len(self.entries)
+
+    def trim(self, count):
+        with self.lock:
+            while len(self.entries) > count:
+                self.entries.pop()
+            self.generation += 1
+            self.rollup = None
+
+    def detach(self):
+        with self.lock:
+            if not self.entries:
+                return None
+            handle, self.entries = self.entries, deque(maxlen=self.entries.maxlen)
+            self.generation += 1
+            self.detached = (handle, self.rollup) if self.rollups else None
+            self.rollup = _Rollup()
+            return handle
+
+    def read(self, handle, count):
+        return list(islice(handle, 0, count))
+
+    def release(self, handle, count, restore=None):
+        for _ in range(min(count, len(handle))):
+            handle.popleft()
+        if restore:
+            rollup = _rollup(restore) if self.rollups else None
+            with self.lock:
+                if len(self.entries) + len(restore) > self.entries.maxlen:
+                    self.rollup = None
+                self.entries.extend(restore)
+                self.generation += 1
+                self._rollup_add(rollup)
+
+    def read_new(self, indexed=0):
+        with self.lock:
+            return self.generation, list(islice(self.entries, 0, max(len(self.entries) - indexed, 0)))
+
+    def rollup_counts(self):
+        if not self.rollups:
+            return None
+        with self.lock:
+            return self.rollup.seconds() if self.rollup is not None else None
+
+    def rollup_count(self, date_from, date_to, log_type="", sub_type=""):
+        if not self.rollups:
+            return None
+        with self.lock:
+            return self.rollup.count(date_from, date_to, log_type, sub_type) if self.rollup is not None else None
+
+    def detached_rollup(self, handle):
+        with self.lock:
+            detached, self.detached = self.detached, None
+        if detached is None or detached[0] is not handle or detached[1] is None:
+            return None
+        return detached[1].seconds()
+
+
+class _FileLock(object):
+    """
+    Exclusive lockf lock on an open file (per process), combined with a thread lock within the process
+    """
+    def __init__(self, fd):
+        if fcntl is None:
+            raise ImportError("File locks need the fcntl module")
+        self.fd = fd
+        self.thread_lock = threading.Lock()
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        fcntl.lockf(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *args):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN)
+        self.thread_lock.release()
+
+
+class SharedMemoryBackend(LogBackend):
+    """
+    Keeps logs in a ring buffer in a memory mapped file that every process on the host can append to
+    Each entry takes one fixed size slot, longer entries spill over into as many following slots as they need,
+    and the cursors live in the file header, so a push is a few memory writes under one lock. Once the ring is
+    full the oldest entries are overwritten. Slots are numbered by a sequence: head is the next one to write,
+    start the oldest one not yet detached by a flush, detached the end of the latest detached batch;
+    length() counts slots.
+    lock="process" is a multiprocessing.Lock, uncontended it takes no syscall, but it is only shared with
+    processes forked after the backend was created (pre-fork servers: create Logist in the master).
+    lock="file" uses lockf on the ring file instead, which works for unrelated processes.
+    """
+    HEADER = struct.Struct("<8sII")
+    CURSORS = struct.Struct("<QQQQ")
+    SLOT_LENGTH = struct.Struct("<I")
+    # flag in the slot length of the slots an entry spilled over into
+    CONTINUED = 0x80000000
+    MAGIC = b"LOGISTRB"
+    DATA_OFFSET = 64
+
+    def __init__(self, path, slots=65536, slot_size=512, lock="process"):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        self.lock = _FileLock(self.fd) if lock == "file" else multiprocessing.Lock()
+        with self.lock:
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            header = os.read(self.fd, self.HEADER.size)
+            if len(header) == self.HEADER.size and self.HEADER.unpack(header)[0] == self.MAGIC:
+                slots, slot_size = self.HEADER.unpack(header)[1:]
+                initialize = False
+            else:
+                os.ftruncate(self.fd, self.DATA_OFFSET + slots * slot_size)
+                initialize = True
+            self.slots = slots
+            self.slot_size = slot_size
+            self.capacity = slots
+            self.buffer = mmap.mmap(self.fd, self.DATA_OFFSET + slots * slot_size)
+            if initialize:
+                self.HEADER.pack_into(self.buffer, 0, self.MAGIC, slots, slot_size)
+                self._set_cursors(0, 0, 0)
+
+    def _cursors(self):
+        """
+        :return: (head, start, generation)
+        """
+        return self.CURSORS.unpack_from(self.buffer, self.HEADER.size)[:3]
+
+    def _set_cursors(self, head, start, generation, detached=None):
+        if detached is None:
+            detached = self.CURSORS.unpack_from(self.buffer, self.HEADER.size)[3]
+        self.CURSORS.pack_into(self.buffer, self.HEADER.size, head, start, generation, detached)
+
+    def _slot_count(self, entry):
+        """
+        :return: number of slots entry takes
+        """
+        payload = self.slot_size - self.SLOT_LENGTH.size
+        return max(1, (len(entry) + payload - 1) // payload)
+
+    def _write_entry(self, sequence, entry):
+        """
+        Write entry to the slots from sequence on
+        :return: number of slots written
+        """
+        payload = self.slot_size - self.SLOT_LENGTH.size
+        count = self._slot_count(entry)
+        if count > self.slots:
+            raise ValueError("Log entry of %d bytes does not fit the ring buffer" % len(entry))
+        for part in range(count):
+            offset = self.DATA_OFFSET + ((sequence + part) % self.slots) * self.slot_size
+            chunk = entry[part * payload:(part + 1) * payload]
+            self.SLOT_LENGTH.pack_into(self.buffer, offset, len(chunk) | (self.CONTINUED if part else 0))
+            offset += self.SLOT_LENGTH.size
+            self.buffer[offset:offset + len(chunk)] = chunk
+        return count
+
+    def _read_slots(self, first, end, head, count=None):
+        """
+        Entries in the slots first <= sequence < end, newest first, leaving out entries (partly) overwritten
+        :param count: read at most count entries
+        :return: (entries, first slot of the oldest entry read)
+        """
+        entries = []
+        parts = []
+        oldest = end
+        sequence = end - 1
+        while sequence >= max(first, head - self.slots) and (count is None or len(entries) < count):
+            offset = self.DATA_OFFSET + (sequence % self.slots) * self.slot_size
+            size = self.SLOT_LENGTH.unpack_from(self.buffer, offset)[0]
+            offset += self.SLOT_LENGTH.size
+            parts.append(self.buffer[offset:offset + (size & ~self.CONTINUED)])
+            if not size & self.CONTINUED:
+                entries.append(b"".join(reversed(parts)) if len(parts) > 1 else parts[0])
+                parts = []
+                oldest = sequence
+            sequence -= 1
+        return entries, oldest
+
+    def push(self, entries, keys=None):
+        with self.lock:
+            head, start, generation = self._cursors()
+            try:
+                for entry in entries:
+                    head += self._write_entry(head, entry)
+            finally:
+                # entries written before one that does not fit are kept
+                if head - start > self.slots:
+                    start = head - self.slots
+                    generation += 1
+                self._set_cursors(head, start, generation)
+            return head - start
+
+    def length(self):
+        head, start = self._cursors()[:2]
+        return head - start
+
+    def trim(self, count):
+        with self.lock:
+            head, start, generation = self._cursors()
+            if head - start > count:
+                self._set_cursors(head, head - count, generation + 1)
+
+    def detach(self):
+        with self.lock:
+            head, start, generation = self._cursors()
+            if head == start:
+                return None
+            self._set_cursors(head, head, generation + 1, detached=head)
+            return [start, head, head]
+
+    def read(self, handle, count):
+        with self.lock:
+            head = self._cursors()[0]
+            return self._read_slots(handle[0], handle[1], head, count)[0]
+
+    def release(self, handle, count, restore=None):
+        with self.lock:
+            head, start, generation, detached = self.CURSORS.unpack_from(self.buffer, self.HEADER.size)
+            handle[1] = self._read_slots(handle[0], handle[1], head, count)[1] if count else handle[1]
+            if not restore:
+                return
+            restore_slots = sum(self._slot_count(entry) for entry in restore)
+            if detached == handle[2] and start - restore_slots >= max(handle[1], head - self.slots):
+                # only released slots lie between this batch and start, put the older entries back there
+                for entry in restore:
+                    start -= self._slot_count(entry)
+                    self._write_entry(start, entry)
+            else:
+                # another flush detached entries in between, keep the restored ones as the newest instead
+                for entry in reversed(restore):
+                    head += self._write_entry(head, entry)
+                start = max(start, head - self.slots)
+            self._set_cursors(head, start, generation + 1)
+
+    def read_new(self, indexed=0):
+        with self.lock:
+            head, start, generation = self._cursors()
+            entries = self._read_slots(start, head, head)[0]
+            # indexed counts entries, which may span several slots each
+            return generation, entries[:max(len(entries) - indexed, 0)]
+
+    def close(self):
+        self.buffer.close()
+        os.close(self.fd)
+
+
+class ShardedBackend(LogBackend):
+    """
+    Spreads logs over several backends, eg. the redis lists NAMESPACE:0..N-1 on one or more redis servers
+    shard_by "worker" hands shards to threads round robin and sends every log of a thread to its shard,
+    "hash" spreads logs by their hash.
+    Queries are scattered to all shards in parallel and gathered, Logist flushes and indexes every shard on its own.
+    """
+    def __init__(self, backends, shard_by="worker"):
+        self.backends = list(backends)
+        self.shard_by = shard_by
+        self.workers = 0
+        self.worker_lock = threading.Lock()
+        self.local = threading.local()
+
+    def shards(self):
+        return list(self.backends)
+
+    def route(self, entries, keys=None):
+        if self.shard_by == "hash":
+            routed = {}
+            for position, entry in enumerate(entries):
+                routed.setdefault(hash(entry) % len(self.backends), []).append(position)
+            return [(self.backends[index], [entries[position] for position in positions],
+                     [keys[position] for position in positions] if keys is not None else None)
+                    for index, positions in routed.items()]
+        worker = getattr(self.local, "worker", None)
+        if worker is None or worker[0] != os.getpid():
+            # first log of this thread, or of a forked child still holding its parent's thread state
+            with self.worker_lock:
+                self.workers += 1
+                worker = (os.getpid(), os.getpid() + self.workers)
+            self.local.worker = worker
+        return [(self.backends[worker[1] % len(self.backends)], entries, keys)]
+
+    def push(self, entries, keys=None):
+        return sum(backend.push(shard_entries, shard_keys) for backend, shard_entries, shard_keys
+                   in self.route(entries, keys))
+
+    def length(self):
+        return sum(backend.length() for backend in self.backends)
+
+    def trim(self, count):
+        for backend in self.backends:
+            backend.trim(count // len(self.backends))
+
+    def detach(self):
+        handle = [[backend, backend.detach()] for backend in self.backends]
+        handle = [part for part in handle if part[1] is not None]
+        return handle or None
+
+    def read(self, handle, count):
+        # shards are read one after the other, release() applies to the shard read last
+        while handle:
+            backend, shard_handle = handle[0]
+            chunk = backend.read(shard_handle, count)
+            if chunk:
+                return chunk
+            handle.pop(0)
+        return []
+
+    def release(self, handle, count, restore=None):
+        backend, shard_handle = handle[0]
+        backend.release(shard_handle, count, restore)
+
+    def detached_rollup(self, handle):
+        rollup = {}
+        for backend, shard_handle in handle:
+            shard_rollup = backend.detached_rollup(shard_handle)
+            if shard_rollup is None:
+                rollup = None
+            elif rollup is not None:
+                for key, count in shard_rollup.items():
+                    rollup[key] = rollup.get(key, 0) + count
+        return rollup
+
+    def read_new(self, indexed=0):
+        """
+        :param indexed: tuple of the indexed count of every shard
+        :return: (tuple of shard generations, entries)
+        """
+        indexed = indexed or (0,) * len(self.backends)
+        generations, entries = [], []
+        for backend, shard_indexed in zip(self.backends, indexed):
+            generation, shard_entries = backend.read_new(shard_indexed)
+            generations.append(generation)
+            entries.extend(shard_entries)
+        return tuple(generations), entries
+
+    def query(self, date_from, date_to, log_type="", sub_type="", description="", count_only=False):
+        results = [None] * len(self.backends)
+
+        def gather(index):
+            results[index] = self.backends[index].query(date_from, date_to, log_type, sub_type, description,
+                                                        count_only)
+        threads = [threading.Thread(target=gather, args=(index,)) for index in range(len(self.backends))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if count_only:
+            return sum(results)
+        return [record for result in results for record in result]
+
+    def rollup_counts(self):
+        rollup = {}
+        for backend in self.backends:
+            shard_rollup = backend.rollup_counts()
+            if shard_rollup is None:
+                return None
+            for key, count in shard_rollup.items():
+                rollup[key] = rollup.get(key, 0) + count
+        return rollup
+
+    def rollup_count(self, date_from, date_to, log_type="", sub_type=""):
+        counted = 0
+        for backend in self.backends:
+            shard_counted = backend.rollup_count(date_from, date_to, log_type, sub_type)
+            if shard_counted is None:
+                return None
+            counted += shard_counted
+        return counted
+
 
 class Logist(object):
     def __init__(self, redis_address="localhost", redis_port=6379, flush_count=10000, file_size=1000000000,
                  log_file_name="default", log_folder="", namespace="DEFAULT", compression=True,
-                 disable_file_flush=False):
+                 disable_file_flush=False, batch_size=0, batch_interval=1.0,
+                 background=False, queue_size=100000, queue_policy="block", compression_level=9,
+                 scan_workers=1, record_format="text", server_query=False, backend="redis",
+                 flusher=True, flush_interval=0, redis_socket="", spool=True, shards=1, shard_by="worker",
+                 shard_nodes=None, rollups=False):
         """
-        # TODO : use memory instead of redis
         REDIS_ADDRESS: Address to redis server
         REDIS_PORT: redis server port
-        FLUSH_COUNT: log count when in-memory logs to be flushed to file
+        REDIS_SOCKET: path to the unix socket of a local redis server, used instead of address and port
+        SPOOL: a boolean field to append logs to <LOG_FILE_NAME>.spool while redis is unreachable and replay
+            them once it is back (True/False)
+        SHARDS: number of lists (NAMESPACE:0..N-1), memory buffers or ring files logs are spread over
+        SHARD_BY: worker (all logs of a thread go to one shard) or hash, always hash with BATCH_SIZE or BACKGROUND
+        SHARD_NODES: list of "host:port" redis servers the shards are spread over, round robin
+        ROLLUPS: a boolean field to keep counters per log_type, sub_type and second next to the logs in redis/memory,
+            answering count() without a description filter without reading the logs (True/False); flushed
+            counters are kept in a <file>.rollup sidecar of every log file
+        FLUSH_COUNT: log count when in-memory logs to be flushed to file, at most 3/4 of what a bounded
+            backend (memory, shared) keeps
         FILE_SIZE: file size when log file to be split up and compressed
         LOG_FILE_NAME: name of the log file
         LOG_FOLDER: folder for log files
         NAMESPACE: a custom namespace for logs to be kept in redis server
         COMPRESSION: a boolean field to enable/disable compression (True/False)
+        COMPRESSION_LEVEL: gzip level (1-9) used for rotated segments
+        BATCH_SIZE: number of logs buffered client-side before a single LPUSH (0 disables batching)
+        BATCH_INTERVAL: max seconds a buffered log waits before being pushed to redis
+        BACKGROUND: a boolean field to hand logs to a background writer thread (True/False)
+        QUEUE_SIZE: max logs waiting for the background writer
+        QUEUE_POLICY: what to do when the queue is full - block, drop_oldest or drop_new
+        SCAN_WORKERS: processes used to scan rotated segments for archive queries (1 scans in-process)
+        RECORD_FORMAT: text or binary, how new logs are encoded in redis and the log files (both are always readable)
+        SERVER_QUERY: a boolean field to run filter()/count() on redis logs as a lua script inside redis (True/False)
+        BACKEND: where logs are kept before they are flushed - redis, memory (in-process), shared (memory mapped
+            ring buffer in <LOG_FILE_NAME>.ring, shared by processes on the host) or a LogBackend instance
+        FLUSHER: a boolean field, whether this instance flushes logs to file; with many processes on one backend,
+            make exactly one of them the flusher (True/False)
+        FLUSH_INTERVAL: seconds between background checks of the backend for FLUSH_COUNT logs (0 disables)
 
         Override configuration file format
         logist_config.json
         {
             "REDIS_ADDRESS": "localhost",
             "REDIS_PORT": 6379,
+            "REDIS_SOCKET": "",
+            "SPOOL": true,
+            "SHARDS": 1,
+            "SHARD_BY": "worker",
+            "SHARD_NODES": [],
+            "ROLLUPS": false,
             "FLUSH_COUNT": 10000,
             "FILE_SIZE": 1000000000,
             "LOG_FILE_NAME": "",
             "LOG_FOLDER": "",
             "NAMESPACE": "PROJECT_NAME",
-            "COMPRESSION": true
+            "COMPRESSION": true,
+            "COMPRESSION_LEVEL": 9,
+            "BATCH_SIZE": 0,
+            "BATCH_INTERVAL": 1.0,
+            "BACKGROUND": false,
+            "QUEUE_SIZE": 100000,
+            "QUEUE_POLICY": "block",
+            "SCAN_WORKERS": 1,
+            "RECORD_FORMAT": "text",
+            "SERVER_QUERY": false,
+            "BACKEND": "redis",
+            "FLUSHER": true,
+            "FLUSH_INTERVAL": 0
         }
         """
-        # TODO : use memory instead of redis
-        self.log_list = []
+        self.log_list = LogIndex()
         self.log_list_type = ""
+        # (second, epoch seconds, "<time> >< ") of the last log stamped with the current time
+        self._stamp = (None, 0, "")
+        self._analytics_mark = None
         try:
             conf_string = open("logist_config.json", 'r').read()
             config = json.loads(conf_string)
@@ -53,46 +1686,204 @@ class Logist(object):
             config = {}
         self.REDIS_ADDRESS = config.get("REDIS_ADDRESS") or redis_address
         self.REDIS_PORT = config.get("REDIS_PORT") or redis_port
+        self.REDIS_SOCKET = config.get("REDIS_SOCKET") or redis_socket
+        self.SPOOL = config.get("SPOOL", spool)
         self.FLUSH_COUNT = config.get("FLUSH_COUNT") or flush_count
         self.FILE_SIZE = config.get("FILE_SIZE") or file_size
         self.LOG_FILE_NAME = config.get("LOG_FILE_NAME") or log_file_name
         self.LOG_FOLDER = config.get("LOG_FOLDER") or log_folder
         self.NAMESPACE = config.get("NAMESPACE") or namespace
         self.COMPRESSION = config.get("COMPRESSION") or compression
-        self.redis_instance = Redis(host=self.REDIS_ADDRESS, port=self.REDIS_PORT)
+        self.COMPRESSION_LEVEL = config.get("COMPRESSION_LEVEL") or compression_level
+        self._segment_index = None
+        self._rotate_lock = threading.Lock()
+        self._seal_threads = []
+        self._write_lock = threading.Lock()
+        self.BACKEND = config.get("BACKEND") or backend
+        self.SHARDS = config.get("SHARDS") or shards
+        self.SHARD_BY = config.get("SHARD_BY") or shard_by
+        self.SHARD_NODES = config.get("SHARD_NODES") or shard_nodes or []
+        if isinstance(self.BACKEND, LogBackend):
+            self.backend = self.BACKEND
+        elif self.SHARDS > 1:
+            self.backend = ShardedBackend([self._m_backend(shard) for shard in range(self.SHARDS)], self.SHARD_BY)
+        else:
+            self.backend = self._m_backend()
+        self.redis_instance = getattr(self.backend, "redis_instance", None)
+        capacity = min([shard.capacity for shard in self.backend.shards() if shard.capacity] or [0])
+        if capacity and self.FLUSH_COUNT > capacity * 3 // 4:
+            # a bounded backend has to be flushed before it starts dropping the oldest logs
+            print("FLUSH_COUNT %d lowered to %d, the backend keeps %d logs" % (self.FLUSH_COUNT, capacity * 3 // 4,
+                                                                             capacity))
+            self.FLUSH_COUNT = capacity * 3 // 4
         self.DISABLE_FILE_FLUSH = config.get("DISABLE_FILE_FLUSH") or disable_file_flush
-        try:
-            self.redis_instance.ping()
-        except ConnectionError:
-            print "Not able to connect to redis.\nPlease install/start redis before proceeding."
+        self.ROLLUPS = config.get("ROLLUPS") or rollups
+        if self.ROLLUPS and not self.DISABLE_FILE_FLUSH:
+            # trimming drops logs unseen, counters could not be kept exact
+            for shard in self.backend.shards():
+                shard.rollups = True
+        self.BATCH_SIZE = config.get("BATCH_SIZE") or batch_size
+        self.BATCH_INTERVAL = config.get("BATCH_INTERVAL") or batch_interval
+        self._batch = []
+        self._batch_keys = []
+        self._batch_time = time.time()
+        self._batch_lock = threading.Lock()
+        self.BACKGROUND = config.get("BACKGROUND") or background
+        self.QUEUE_SIZE = config.get("QUEUE_SIZE") or queue_size
+        self.QUEUE_POLICY = config.get("QUEUE_POLICY") or queue_policy
+        if isinstance(self.backend, ShardedBackend) and self.backend.shard_by == "worker" and \
+                (self.BACKGROUND or self.BATCH_SIZE):
+            # logs are pushed by the writer thread or whichever thread fills the batch, not by the thread
+            # that wrote them, so a shard per pushing thread would pile everything on one shard
+            self.SHARD_BY = self.backend.shard_by = "hash"
+        self.queued_count = 0
+        self.dropped_count = 0
+        self.written_count = 0
+        self.flushed_count = 0
+        self.flush_durations = [0] * len(FLUSH_HISTOGRAM)
+        self.rotated_bytes = 0
+        self.log_list_hits = 0
+        self.log_list_misses = 0
+        self._queue = None
+        self._worker = None
+        if self.BACKGROUND:
+            self._queue = Queue(maxsize=self.QUEUE_SIZE)
+            self._worker = threading.Thread(target=self._q_worker, args=(self._queue,), name="logist-writer")
+            self._worker.daemon = True
+            self._worker.start()
+        self.SCAN_WORKERS = config.get("SCAN_WORKERS") or scan_workers
+        self._scan_pool = None
+        # rollup sidecars read so far, by path, see _file_rollup()
+        self._file_rollups = {}
+        self._file_rollups_lock = threading.Lock()
+        self.RECORD_FORMAT = config.get("RECORD_FORMAT") or record_format
+        self.SERVER_QUERY = config.get("SERVER_QUERY") or server_query
+        self.FLUSHER = config.get("FLUSHER", flusher)
+        self.FLUSH_INTERVAL = config.get("FLUSH_INTERVAL") or flush_interval
+        self._closing = threading.Event()
+        self._batch_thread = None
+        self._flush_thread = None
+        if self.FLUSHER and self.FLUSH_INTERVAL:
+            self._flush_thread = threading.Thread(target=self._f_worker, name="logist-flusher")
+            self._flush_thread.daemon = True
+            self._flush_thread.start()
+        if self.BATCH_SIZE and not self.BACKGROUND:
+            self._batch_thread = threading.Thread(target=self._b_worker, name="logist-batcher")
+            self._batch_thread.daemon = True
+            self._batch_thread.start()
+        if self.BATCH_SIZE or self.BACKGROUND or self._flush_thread is not None:
+            atexit.register(self.close)
 
-    def _f_write(self, force_compress=False):
+    def _m_backend(self, shard=None):
+        """
+        Private function creating the backend named by self.BACKEND, or one shard of it
+        :param shard: shard number, stored under NAMESPACE:<shard> (redis) or <LOG_FILE_NAME>_<shard> (files)
+        :return: LogBackend
+        """
+        file_name = os.path.join(self.LOG_FOLDER, self.LOG_FILE_NAME)
+        namespace, host, port = self.NAMESPACE, self.REDIS_ADDRESS, self.REDIS_PORT
+        if shard is not None:
+            file_name = "%s_%d" % (file_name, shard)
+            namespace = "%s:%d" % (namespace, shard)
+            if self.SHARD_NODES:
+                host, port = self.SHARD_NODES[shard % len(self.SHARD_NODES)].rsplit(":", 1)
+                port = int(port)
+        if self.BACKEND == "memory":
+            return MemoryBackend()
+        if self.BACKEND == "shared":
+            return SharedMemoryBackend("%s.ring" % file_name)
+        spool_path = "%s.spool" % file_name if self.SPOOL else ""
+        return RedisBackend(namespace, host, port, "" if self.SHARD_NODES else self.REDIS_SOCKET, spool_path)
+
+    def _f_write(self, force_compress=False, shard=None):
         """
         Private function to flush logs to file once redis reaches self.FLUSH_COUNT
+        Only called in the FLUSHER instance
         :param force_compress: will forcefully create a new compressed file
+        :param shard: flush only this shard of a sharded backend, default all of them one after the other
         if DISABLE_FILE_FLUSH is True, will keep triming to flush limit, else
         dump to the file, and flush the memory. 
         """
-        if self.LOG_FOLDER:
-            file_location = os.path.join(self.LOG_FOLDER, self.LOG_FILE_NAME)
-        else:
-            file_location = self.LOG_FILE_NAME
-        file_location = "%s.log" % file_location
-        if self.DISABLE_FILE_FLUSH:
-            self.redis_instance.ltrim(self.NAMESPACE, 0, self.FLUSH_COUNT - 1)
-        else:
-            redis_dump = "%s\n" % "\n".join(self.redis_instance.lrange(self.NAMESPACE, 0, -1))
-            self.redis_instance.delete(self.NAMESPACE)
-            try:
-                file_instance = open(file_location, "a")
-                file_instance.write(redis_dump)
-                file_instance.close()
-            except IOError:
-                print("Cannot open file: %s" % file_location)
-            if os.path.getsize(file_location) > self.FILE_SIZE or force_compress:
+        file_location = self._log_file_location()
+        shards = [shard] if shard is not None else self.backend.shards()
+        for backend in shards:
+            started = time.time()
+            if self.DISABLE_FILE_FLUSH:
+                backend.trim(self.FLUSH_COUNT)
+                self._f_timed(started)
+                continue
+            # the current batch is detached atomically; entries pushed from here on start a fresh list.
+            # Batches orphaned by a crashed flusher are older, they are written first
+            batches = [batch for batch in backend.orphans() + [backend.detach()] if batch is not None]
+            if not batches:
+                # list is already gone, another writer is flushing it
+                continue
+            # counters of the detached logs, carried over to the rollup sidecar of the log file
+            rollups = [backend.detached_rollup(batch) for batch in batches]
+            with self._write_lock:
+                try:
+                    file_instance = _open_append(file_location)
+                except IOError:
+                    print("Cannot open file: %s" % file_location)
+                    for batch in batches:
+                        self._f_restore(batch, backend)
+                    continue
+                with file_instance:
+                    # a sidecar counts every log of its file, so counting starts with an empty file
+                    sidecar = os.path.isfile(_rollup_path(file_location))
+                    counted = self.ROLLUPS and (sidecar or not os.fstat(file_instance.fileno()).st_size)
+                    if sidecar and not counted:
+                        _append_rollup(file_location, None)
+                    flushed = {}
+                    for batch, rollup in zip(batches, rollups):
+                        while 1:
+                            chunk = backend.read(batch, FLUSH_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            file_instance.write(b"".join(entry + b"\n" for entry in chunk))
+                            if counted and rollup is None:
+                                # no counters came with this batch, count the logs themselves
+                                for key in _rollup_keys(chunk):
+                                    flushed[key] = flushed.get(key, 0) + 1
+                            backend.release(batch, len(chunk))
+                        if counted and rollup is not None:
+                            for key, count in rollup.items():
+                                flushed[key] = flushed.get(key, 0) + count
+                    if counted:
+                        _append_rollup(file_location, flushed)
+            self._f_timed(started)
+        if not self.DISABLE_FILE_FLUSH and os.path.isfile(file_location) and \
+                (os.path.getsize(file_location) > self.FILE_SIZE or force_compress):
+            with self._write_lock:
                 self._f_compress(file_location)
         return
 
+    def _f_timed(self, started):
+        """
+        Private function accounting for one flush in stats()
+        :param started: time.time() the flush started at
+        :return: None
+        """
+        self.flushed_count += 1
+        self.flush_durations[bisect_left(FLUSH_HISTOGRAM, time.time() - started)] += 1
+        return
+
+    def _f_restore(self, batch, backend=None):
+        """
+        Private function to hand a detached flush batch back to the backend when it could not be written to file
+        The batch is older than anything pushed since, so it goes back at the tail of the list
+        :param batch: handle returned by backend.detach()
+        :param backend: the (shard) backend the batch was detached from, default self.backend
+        :return: None
+        """
+        backend = backend or self.backend
+        while 1:
+            chunk = backend.read(batch, FLUSH_CHUNK_SIZE)
+            if not chunk:
+                break
+            backend.release(batch, len(chunk), restore=chunk)
+        return
+
     def config(self):
         """
         Print the current configuration of the Logist class
@@ -101,12 +1892,30 @@ class Logist(object):
         conf = {
             "REDIS_ADDRESS": self.REDIS_ADDRESS,
             "REDIS_PORT": self.REDIS_PORT,
+            "REDIS_SOCKET": self.REDIS_SOCKET,
+            "SPOOL": self.SPOOL,
+            "SHARDS": self.SHARDS,
+            "SHARD_BY": self.SHARD_BY,
+            "SHARD_NODES": self.SHARD_NODES,
+            "ROLLUPS": self.ROLLUPS,
             "FLUSH_COUNT": self.FLUSH_COUNT,
             "FILE_SIZE": self.FILE_SIZE,
             "LOG_FILE_NAME": self.LOG_FILE_NAME,
             "LOG_FOLDER": self.LOG_FOLDER,
             "NAMESPACE": self.NAMESPACE,
-            "COMPRESSION": self.COMPRESSION
+            "COMPRESSION": self.COMPRESSION,
+            "COMPRESSION_LEVEL": self.COMPRESSION_LEVEL,
+            "BATCH_SIZE": self.BATCH_SIZE,
+            "BATCH_INTERVAL": self.BATCH_INTERVAL,
+            "BACKGROUND": self.BACKGROUND,
+            "QUEUE_SIZE": self.QUEUE_SIZE,
+            "QUEUE_POLICY": self.QUEUE_POLICY,
+            "SCAN_WORKERS": self.SCAN_WORKERS,
+            "RECORD_FORMAT": self.RECORD_FORMAT,
+            "SERVER_QUERY": self.SERVER_QUERY,
+            "BACKEND": type(self.BACKEND).__name__ if isinstance(self.BACKEND, LogBackend) else self.BACKEND,
+            "FLUSHER": self.FLUSHER,
+            "FLUSH_INTERVAL": self.FLUSH_INTERVAL
         }
         return conf
 
@@ -120,39 +1929,363 @@ class Logist(object):
         :param log_time: time of the logging - else auto populate
         :return: None
         """
-        log_time = datetime.strftime(log_time or datetime.now(), "%Y-%m-%dT%H:%M:%SZ")
-        self.redis_instance.lpush(self.NAMESPACE, "%s >< %s :: %s || %s" %
-                                  (log_time, log_type, sub_type, description))
-        if self.redis_instance.llen(self.NAMESPACE) >= self.FLUSH_COUNT:
-            self._f_write()
+        entry, log_second = self._m_record(log_type, sub_type, description, log_time)
+        # rollup key from the values in hand, parsing the record back would cost more than formatting it
+        key = (log_type, sub_type, int(log_second)) if self.ROLLUPS else None
+        if self._queue is not None:
+            self._q_put((entry, key))
+            return
+        if not self.BATCH_SIZE:
+            self._m_push([entry], [key] if key else None)
+            return
+        with self._batch_lock:
+            if not self._batch:
+                # BATCH_INTERVAL counts from the oldest buffered log
+                self._batch_time = time.time()
+            self._batch.append(entry)
+            self._batch_keys.append(key)
+            if len(self._batch) < self.BATCH_SIZE and time.time() - self._batch_time < self.BATCH_INTERVAL:
+                return
+            batch, keys, self._batch, self._batch_keys = self._batch, self._batch_keys, [], []
+            self._batch_time = time.time()
+        self._m_push(batch, keys if self.ROLLUPS else None)
+        return
+
+    def _m_format(self, log_type, sub_type, description, log_time=None):
+        """
+        Private function encoding a log as a RECORD_FORMAT record
+        :param log_time: time of the logging - else auto populate
+        :return: record string
+        """
+        return self._m_record(log_type, sub_type, description, log_time)[0]
+
+    def _m_record(self, log_type, sub_type, description, log_time=None):
+        """
+        Private function encoding a log as a RECORD_FORMAT record
+        Logs stamped with the current time reuse the formatted time prefix until the clock ticks to the next second
+        :param log_time: time of the logging - else auto populate
+        :return: (record string, epoch seconds of the record)
+        """
+        if not log_time:
+            second = int(time.time())
+            stamp = self._stamp
+            if stamp[0] != second:
+                now = datetime.fromtimestamp(second)
+                stamp = self._stamp = (second, _to_epoch(now), "%s >< " % now.strftime(TIME_FORMAT))
+            if self.RECORD_FORMAT == "binary":
+                return _format_binary(stamp[1], log_type, sub_type, description), stamp[1]
+            return _utf8("%s%s :: %s || %s" % (stamp[2], log_type, sub_type, description)), stamp[1]
+        epoch = _to_epoch(log_time)
+        if self.RECORD_FORMAT == "binary":
+            return _format_binary(epoch, log_type, sub_type, description), epoch
+        return _utf8("%s >< %s :: %s || %s" % (log_time.strftime(TIME_FORMAT), log_type, sub_type, description)), epoch
+
+    def _m_push(self, entries, keys=None):
+        """
+        Private function to push a list of log entries to redis in a single LPUSH (one per shard they route to)
+        The list length returned by LPUSH is used to decide on flushing, saving an LLEN round-trip;
+        a shard reaching FLUSH_COUNT is flushed on its own
+        :param entries: formatted log entries, oldest first
+        :param keys: rollup keys (log_type, sub_type, epoch second) of the entries, if rollups are kept
+        :return: None
+        """
+        if not entries:
+            return
+        self.written_count += len(entries)
+        for backend, shard_entries, shard_keys in self.backend.route(entries, keys):
+            if backend.push(shard_entries, shard_keys) >= self.FLUSH_COUNT and self.FLUSHER:
+                self._f_write(shard=backend)
+        return
+
+    def _f_worker(self):
+        """
+        Private function run by the flusher thread, flushes once the backend holds FLUSH_COUNT logs,
+        whoever pushed them
+        :return: None
+        """
+        while not self._closing.wait(self.FLUSH_INTERVAL):
+            try:
+                for backend in self.backend.shards():
+                    if backend.length() >= self.FLUSH_COUNT:
+                        self._f_write(shard=backend)
+            except Exception as e:
+                print("Background flush failed: %s" % e)
+        return
+
+    def _b_worker(self):
+        """
+        Private function run by the batch thread, pushes buffered logs once the oldest waited BATCH_INTERVAL,
+        even when no further log() comes
+        :return: None
+        """
+        wait = self.BATCH_INTERVAL
+        while not self._closing.wait(wait):
+            with self._batch_lock:
+                waited = time.time() - self._batch_time if self._batch else 0
+            if waited < self.BATCH_INTERVAL:
+                wait = self.BATCH_INTERVAL - waited
+                continue
+            wait = self.BATCH_INTERVAL
+            try:
+                self._m_flush()
+            except Exception as e:
+                print("Background batch push failed: %s" % e)
+        return
+
+    def _m_flush(self):
+        """
+        Private function to push the client-side batch buffer to redis
+        :return: None
+        """
+        with self._batch_lock:
+            batch, keys, self._batch, self._batch_keys = self._batch, self._batch_keys, [], []
+            self._batch_time = time.time()
+        self._m_push(batch, keys if self.ROLLUPS else None)
+        return
+
+    def _q_put(self, entry):
+        """
+        Private function to hand a log entry to the background writer according to QUEUE_POLICY
+        :param entry: (formatted log entry, rollup key or None)
+        :return: None
+        """
+        if self.QUEUE_POLICY == "drop_new":
+            try:
+                self._queue.put_nowait(entry)
+            except Full:
+                self.dropped_count += 1
+                return
+        elif self.QUEUE_POLICY == "drop_oldest":
+            while 1:
+                try:
+                    self._queue.put_nowait(entry)
+                    break
+                except Full:
+                    try:
+                        self._queue.get_nowait()
+                        self.dropped_count += 1
+                    except Empty:
+                        pass
+        else:
+            self._queue.put(entry)
+        self.queued_count += 1
+        return
+
+    def _q_worker(self, queue):
+        """
+        Private function run by the background writer thread
+        Drains whatever is queued into one LPUSH, and does the file flush/rotation off the caller's thread
+        Exits once it reads the None sentinel put by close()
+        :param queue: the queue to drain, handed over at start since close() may detach it before the thread runs
+        :return: None
+        """
+        running = True
+        while running:
+            batch = [queue.get()]
+            while len(batch) < self.QUEUE_SIZE:
+                try:
+                    batch.append(queue.get_nowait())
+                except Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [entry for entry in batch if entry is not None]
+            try:
+                self._m_push([entry for entry, _ in batch], [key for _, key in batch] if self.ROLLUPS else None)
+            except Exception as e:
+                self.dropped_count += len(batch)
+                print("Background writer failed to push %d logs: %s" % (len(batch), e))
+        return
+
+    def queue_stats(self):
+        """
+        Counters of the background writer
+        :return: dict with queued (total accepted), dropped (total discarded) and pending (waiting in queue) logs
+        """
+        return {
+            "queued": self.queued_count,
+            "dropped": self.dropped_count,
+            "pending": self._queue.qsize() if self._queue is not None else 0
+        }
+
+    def stats(self):
+        """
+        Runtime counters of the write, flush and query paths
+        :return: dict with written (logs pushed to the backend), flushes, flush_duration (list of
+            [upper bound in seconds, flushes]), rotated_bytes, log_list_hits and log_list_misses (queries answered
+            from the cached index / after reading the source) plus the queue_stats() counters
+        """
+        stats = {
+            "written": self.written_count,
+            "flushes": self.flushed_count,
+            "flush_duration": [[bound, count] for bound, count in zip(FLUSH_HISTOGRAM, self.flush_durations)],
+            "rotated_bytes": self.rotated_bytes,
+            "log_list_hits": self.log_list_hits,
+            "log_list_misses": self.log_list_misses
+        }
+        stats.update(self.queue_stats())
+        return stats
+
+    def close(self):
+        """
+        Push any buffered logs to redis, stop the background writer, wait for pending compressions
+        and shut down the segment scan processes.
+        Registered with atexit when batching, background writing or the flusher thread is enabled
+        :return: None
+        """
+        self._closing.set()
+        queue, self._queue = self._queue, None
+        if queue is not None:
+            queue.put(None)
+            self._worker.join()
+        # a batch or flusher thread still waiting at interpreter exit dies with a traceback on Python 2
+        for thread in [self._batch_thread, self._flush_thread]:
+            if thread is not None:
+                thread.join()
+        self._m_flush()
+        for thread in self._seal_threads:
+            thread.join()
+        scan_pool, self._scan_pool = self._scan_pool, None
+        if scan_pool is not None:
+            scan_pool.shutdown()
         return
 
+    def _file_rollup(self, path):
+        """
+        Private function returning the counters of a log file from its rollup sidecar, read once and then
+        followed as flushes add to it
+        :param path: live log file or segment (.log or .log.gz)
+        :return: _Rollup, None without a complete sidecar
+        """
+        with self._file_rollups_lock:
+            cached = _read_rollup(path, self._file_rollups.get(_rollup_path(path)))
+            if cached is None:
+                self._file_rollups.pop(_rollup_path(path), None)
+                return None
+            self._file_rollups[_rollup_path(path)] = cached
+            return cached[2]
+
+    def _log_file_location(self):
+        """
+        Private function returning the path of the live log file
+        :return: path to <LOG_FILE_NAME>.log
+        """
+        if self.LOG_FOLDER:
+            return "%s.log" % os.path.join(self.LOG_FOLDER, self.LOG_FILE_NAME)
+        return "%s.log" % self.LOG_FILE_NAME
+
+    def _segment_name(self, index):
+        """
+        Private function returning the path of rotated segment number index (uncompressed name)
+        :param index: segment number
+        :return: path to <LOG_FILE_NAME>_<index>.log
+        """
+        file_name = "%s_%d.log" % (self.LOG_FILE_NAME, index)
+        if self.LOG_FOLDER:
+            return os.path.join(self.LOG_FOLDER, file_name)
+        return file_name
+
+    def _list_segments(self):
+        """
+        Private function listing rotated segments with a single directory listing
+        :return: dict of segment number -> set of the extensions present (".log" and/or ".log.gz")
+        """
+        pattern = re.compile(r"^%s_(\d+)(\.log(?:\.gz)?)$" % re.escape(self.LOG_FILE_NAME))
+        segments = {}
+        try:
+            file_names = os.listdir(self.LOG_FOLDER or ".")
+        except OSError:
+            return segments
+        for file_name in file_names:
+            match = pattern.match(file_name)
+            if match:
+                segments.setdefault(int(match.group(1)), set()).add(match.group(2))
+        return segments
+
+    def _scan_segments(self):
+        """
+        Private function to find the highest rotated segment number
+        :return: highest segment number in use, 0 if there is none
+        """
+        return max(self._list_segments() or [0])
+
+    def _archive_files(self, date_from, date_to):
+        """
+        Private function listing the files an archive query has to read, oldest first
+        Rotated segments whose sidecar min/max falls outside the date range are skipped without being opened
+        :param date_from: epoch seconds
+        :param date_to: epoch seconds
+        :return: list of paths, the live log file last
+        """
+        paths = []
+        for index, extensions in sorted(self._list_segments().items()):
+            segment = self._segment_name(index)
+            meta = _segment_meta(segment)
+            if not meta["count"] or meta["max"] <= date_from or meta["min"] >= date_to:
+                continue
+            # while compression is in progress both exist, the .log is the complete one
+            paths.append(segment if ".log" in extensions else "%s.gz" % segment)
+        file_location = self._log_file_location()
+        if os.path.isfile(file_location):
+            paths.append(file_location)
+        return paths
+
     def _f_compress(self, file_location):
-        count = 1
-        log_file = file_location
-        while 1:
-            file_name = "%s_%d" % (self.LOG_FILE_NAME, count)
-            if self.COMPRESSION:
-                if self.LOG_FOLDER:
-                    compressed_file_name = "%s.log.gz" % os.path.join(self.LOG_FOLDER, file_name)
-                else:
-                    compressed_file_name = "%s.log.gz" % file_name
-                if not os.path.isfile(compressed_file_name):
-                    with open(log_file, 'rb') as f_in, gzip.open(compressed_file_name, 'wb') as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                        open(log_file, 'w').close()
-                    return
-            else:
-                if self.LOG_FOLDER:
-                    uncompressed_file_name = "%s.log" % os.path.join(self.LOG_FOLDER, file_name)
-                else:
-                    uncompressed_file_name = "%s.log" % file_name
-                if not os.path.isfile(uncompressed_file_name):
-                    with open(log_file, 'r') as f_in, open(uncompressed_file_name, 'w') as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                        open(log_file, 'w').close()
+        """
+        Private function to rotate the live log file into the next segment
+        The live file is renamed atomically while holding the flock writers append under,
+        so concurrent writers simply start a new file, and writing the min/max sidecar plus gzip compression runs in a background thread.
+        The rollup sidecar of the live file, if any, moves along with it.
+        The next segment number comes from a directory scan cached on first rotation;
+        names are claimed with O_EXCL so processes sharing the folder never collide.
+        :param file_location: path of the live log file
+        :return: None
+        """
+        with self._rotate_lock:
+            if self._segment_index is None:
+                self._segment_index = self._scan_segments()
+            while 1:
+                self._segment_index += 1
+                segment = self._segment_name(self._segment_index)
+                try:
+                    os.close(os.open(segment, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                    continue
+                if os.path.isfile("%s.gz" % segment):
+                    os.remove(segment)
+                    continue
+                break
+            try:
+                live_file = open(file_location, "rb")
+            except IOError:
+                # live file was already rotated by another writer
+                os.remove(segment)
+                return
+            with live_file:
+                # writers append under the same flock, once it is ours nobody writes to this inode any more
+                if fcntl is not None:
+                    fcntl.flock(live_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    rotated = os.fstat(live_file.fileno()).st_ino != os.stat(file_location).st_ino
+                except OSError:
+                    rotated = True
+                if rotated:
+                    os.remove(segment)
                     return
-            count += 1
+                os.rename(file_location, segment)
+                try:
+                    os.rename(_rollup_path(file_location), _rollup_path(segment))
+                except OSError:
+                    # logs of this file were not counted
+                    pass
+            self.rotated_bytes += os.path.getsize(segment)
+        self._seal_threads = [thread for thread in self._seal_threads if thread.is_alive()]
+        thread = threading.Thread(target=_seal_segment, name="logist-seal",
+                                  args=(segment, self.COMPRESSION_LEVEL if self.COMPRESSION else None))
+        thread.start()
+        self._seal_threads.append(thread)
         return
 
     def log(self, log_type, sub_type, description, log_time=None):
@@ -228,31 +2361,103 @@ class Logist(object):
         :param source: run analytics on logs in redis or in the last created file
         :return: None
         """
-        # TODO - analytics is not available over compressed files for now
-        self.log_list = []
-        log_source = []
+        self.log_list = LogIndex()
+        self.log_list_type = source
+        self._analytics_mark = None
+        self._analytics_update(source)
+        return
+
+    def _analytics_update(self, source="redis"):
+        """
+        Private function indexing only the logs appended to source since the last load
+        The high-water mark is (inode, byte offset) for the file and (generation, indexed count) per shard for redis;
+        new redis entries are everything but the already indexed tail of the list.
+        Falls back to a full _analytics_bootstrap when entries were removed in between (flush, trim, rotation)
+        :param source: redis/file
+        :return: None
+        """
+        if self.log_list_type != source:
+            return self._analytics_bootstrap(source)
         if source == "file":
-            self.log_list_type = "file"
-            if self.LOG_FOLDER:
-                file_name = "%s.log" % os.path.join(self.LOG_FOLDER, self.LOG_FILE_NAME)
-            else:
-                file_name = "%s.log" % self.LOG_FILE_NAME
+            file_name = self._log_file_location()
             try:
-                log_source = open(file_name).readlines()
+                file_instance = open(file_name, 'rb')
             except IOError:
                 print("File Not Found: %s" % file_name)
                 return
+            with file_instance:
+                file_stat = os.fstat(file_instance.fileno())
+                inode, offset = self._analytics_mark or (file_stat.st_ino, 0)
+                if inode != file_stat.st_ino or file_stat.st_size < offset:
+                    return self._analytics_bootstrap(source)
+                file_instance.seek(offset)
+                # streamed record by record, a record still being written is picked up on the next refresh
+                read_to = [offset]
+
+                def log_source():
+                    for record in _iter_records(file_instance):
+                        read_to[0] += len(record) + 1
+                        yield record
+                self.log_list.extend(self._parse_lines(log_source()))
+            self._analytics_mark = (inode, read_to[0])
+            return
+        else:
+            self._m_flush()
+            marks = []
+            log_source = []
+            for index, shard in enumerate(self.backend.shards()):
+                # one (generation, indexed count) mark per shard
+                generation, indexed = self._analytics_mark[index] if self._analytics_mark else (None, 0)
+                current_generation, shard_source = shard.read_new(indexed)
+                if self._analytics_mark is not None and current_generation != generation:
+                    return self._analytics_bootstrap(source)
+                marks.append((current_generation, indexed + len(shard_source)))
+                log_source.extend(shard_source)
+            self._analytics_mark = marks
+        self.log_list.extend(self._parse_lines(log_source))
+        return
+
+    @staticmethod
+    def _parse_lines(records):
+        """
+        Private generator parsing log records, skipping malformed ones
+        :param records: iterable of text or binary log records
+        :return: generator of (epoch seconds, log_type, sub_type, description)
+        """
+        for record in records:
+            try:
+                yield _parse_record(record)
+            except ValueError:
+                continue
+
+    def _analytics_load(self, source, force_refresh=False):
+        """
+        Private function making sure self.log_list holds the logs of source
+        :param source: redis/file
+        :param force_refresh: index logs added to source since the last load
+        :return: None
+        """
+        source = "file" if source == "file" else "redis"
+        if self.log_list_type != source:
+            self.log_list_misses += 1
+            self._analytics_bootstrap(source=source)
+        elif force_refresh or not self.log_list:
+            self.log_list_misses += 1
+            self._analytics_update(source=source)
         else:
-            self.log_list_type = "redis"
-            log_source = self.redis_instance.lrange(self.NAMESPACE, 0, -1)
-        for log in log_source:
-            log_time = datetime.strptime(log.split(" ><")[0], "%Y-%m-%dT%H:%M:%SZ")
-            log_type = log.split(">< ")[1].split(" :: ")[0]
-            sub_type = log.split(":: ")[1].split(" || ")[0]
-            description = log.split("|| ")[1]
-            self.log_list.append([log_time, log_type, sub_type, description])
+            self.log_list_hits += 1
         return
 
+    @staticmethod
+    def _date_range(date_from, date_to):
+        """
+        Private function converting the optional date filters to epoch seconds
+        :return: (date_from, date_to) defaulting to the beginning of time and now
+        """
+        date_from = _to_epoch(date_from) if date_from else float("-inf")
+        date_to = _to_epoch(date_to or datetime.now())
+        return date_from, date_to
+
     def _filter(self, source, date_from="", date_to="", log_type="", sub_type="", description="", force_refresh=False):
         """
         Private function to filter over the logs in redis using log_type, sub_type and description
@@ -262,19 +2467,13 @@ class Logist(object):
         :param force_refresh: refresh cached log list in redis calling _analytics_bootstrap()
         :return: None
         """
-        if (not(self.log_list and self.log_list_type == "file") and source == "file") or (source == "file" and force_refresh):
-            self._analytics_bootstrap(source="file")
-        if (not(self.log_list and self.log_list_type == "redis") and source == "redis") or (source == "redis" and force_refresh):
-            self._analytics_bootstrap()
-        if not date_to:
-            date_to = datetime.now()
-        if not date_from:
-            date_from = datetime.fromtimestamp(0)
-        filter_query = []
-        for log in self.log_list:
-            if (log_type in log[1] and sub_type in log[2] and description in log[3]) and (date_from < log[0] < date_to):
-                filter_query.append(log)
-        return filter_query
+        date_from, date_to = self._date_range(date_from, date_to)
+        if source == "archive":
+            return self._archive_query(date_from, date_to, log_type, sub_type, description)
+        if source != "file" and self.SERVER_QUERY:
+            return self._server_query(date_from, date_to, log_type, sub_type, description)
+        self._analytics_load(source, force_refresh)
+        return self.log_list.filter(date_from, date_to, log_type, sub_type, description)
 
     def _count(self, source, date_from="", date_to="", log_type="", sub_type="", description="", force_refresh=False):
         """
@@ -285,21 +2484,84 @@ class Logist(object):
         :param force_refresh: refresh cached log list in redis calling _analytics_bootstrap()
         :return: None
         """
-        if (not(self.log_list and self.log_list_type == "file") and source == "file") or (source == "file" and force_refresh):
-            self._analytics_bootstrap(source="file")
-        if (not(self.log_list and self.log_list_type == "redis") and source == "redis") or (source == "redis" and force_refresh):
-            self._analytics_bootstrap()
-        if not date_to:
-            date_to = datetime.now()
-        if not date_from:
-            date_from = datetime.fromtimestamp(0)
-        if not self.log_list or force_refresh:
-            self._analytics_bootstrap()
-        filter_count = 0
-        for log in self.log_list:
-            if (log_type in log[1] and sub_type in log[2] and description in log[3]) and (date_from < log[0] < date_to):
-                filter_count += 1
-        return filter_count
+        date_from, date_to = self._date_range(date_from, date_to)
+        if source == "archive":
+            return self._archive_query(date_from, date_to, log_type, sub_type, description, count_only=True)
+        if source == "file" and not description:
+            rollup = self._file_rollup(self._log_file_location())
+            if rollup is not None:
+                return rollup.count(date_from, date_to, log_type, sub_type)
+        if source != "file" and self.ROLLUPS and not description:
+            self._m_flush()
+            counted = self.backend.rollup_count(date_from, date_to, log_type, sub_type)
+            if counted is not None:
+                return counted
+        if source != "file" and self.SERVER_QUERY:
+            return self._server_query(date_from, date_to, log_type, sub_type, description, count_only=True)
+        self._analytics_load(source, force_refresh)
+        return self.log_list.count(date_from, date_to, log_type, sub_type, description)
+
+    def _server_query(self, date_from, date_to, log_type="", sub_type="", description="", count_only=False):
+        """
+        Private function evaluating a filter()/count() query in the backend, with QUERY_SCRIPT for redis
+        Only the count or the matching records cross the network, and the local index is left untouched
+        :param date_from: epoch seconds
+        :param date_to: epoch seconds
+        :param count_only: return the number of matches instead of the rows
+        :return: int if count_only, else list of [datetime, log_type, sub_type, description] in time order
+        """
+        self._m_flush()
+        result = self.backend.query(date_from, date_to, log_type, sub_type, description, count_only)
+        if count_only:
+            return result
+        filter_query = [[EPOCH + timedelta(seconds=log[0])] + list(log[1:]) for log in self._parse_lines(result)]
+        filter_query.sort(key=lambda log: log[0])
+        return filter_query
+
+    def _archive_query(self, date_from, date_to, log_type="", sub_type="", description="", count_only=False):
+        """
+        Private function streaming a filter()/count() query over every rotated segment and the live log file
+        Nothing is cached, each segment is read line by line and decompressed on the fly.
+        With SCAN_WORKERS > 1 segments are scanned in parallel by a process pool and the partial results merged.
+        Counts without description filter take files from their rollup sidecar, segments lying completely inside
+        the date range from their min/max sidecar.
+        :param date_from: epoch seconds
+        :param date_to: epoch seconds
+        :param count_only: return the number of matches instead of the rows
+        :return: int if count_only, else list of [datetime, log_type, sub_type, description] in time order
+        """
+        paths = self._archive_files(date_from, date_to)
+        counted = 0
+        if count_only and not description:
+            file_location = self._log_file_location()
+            scan_paths = []
+            for path in paths:
+                rollup = self._file_rollup(path)
+                if rollup is not None:
+                    counted += rollup.count(date_from, date_to, log_type, sub_type)
+                    continue
+                meta = _segment_meta(path[:-3] if path.endswith(".gz") else path) if path != file_location else {}
+                if "counts" in meta and date_from < meta["min"] and meta["max"] < date_to:
+                    counted += sum(count for log_type_re, sub_types in meta["counts"].items() if log_type in log_type_re
+                                   for sub_type_re, count in sub_types.items() if sub_type in sub_type_re)
+                else:
+                    scan_paths.append(path)
+            paths = scan_paths
+        query = (date_from, date_to, log_type, sub_type, description, count_only)
+        if self.SCAN_WORKERS > 1 and ProcessPoolExecutor is not None and len(paths) > 1:
+            if self._scan_pool is None:
+                self._scan_pool = ProcessPoolExecutor(max_workers=self.SCAN_WORKERS)
+            futures = [self._scan_pool.submit(_scan_segment, path, *query) for path in paths]
+            results = [future.result() for future in futures]
+        else:
+            results = [_scan_segment(path, *query) for path in paths]
+        if count_only:
+            return counted + sum(results)
+        filter_query = []
+        for result in results:
+            filter_query.extend(result)
+        filter_query.sort(key=lambda log: log[0])
+        return filter_query
 
     def count(self, date_from="", date_to="", log_type="", sub_type="", description="", log_source="redis",
               force_refresh=False):
@@ -307,7 +2569,7 @@ class Logist(object):
         Function to count the matching logs in last created file with filters log_type, sub_type and description
         :param date_to: filter logs till date_to - datetime object
         :param date_from: filter logs till date_from - datetime object
-        :param log_source: redis/file
+        :param log_source: redis/file/archive (all rotated segments and the live file)
         :param log_type: type of log - ERROR, WARNING, SUCCESS, INFO, DEBUG
         :param sub_type: custom log sub types for easy tracking - Eg: ACCESS, WRITE, READ, EDIT, DELETE
         :param description: brief log description
@@ -322,7 +2584,7 @@ class Logist(object):
         Function to count the matching logs in last created file with filters log_type, sub_type and description
         :param date_to: filter logs till date_to - datetime object
         :param date_from: filter logs till date_from - datetime object
-        :param log_source: redis/file
+        :param log_source: redis/file/archive (all rotated segments and the live file)
         :param log_type: type of log - ERROR, WARNING, SUCCESS, INFO, DEBUG
         :param sub_type: custom log sub types for easy tracking - Eg: ACCESS, WRITE, READ, EDIT, DELETE
         :param description: brief log description
@@ -334,13 +2596,12 @@ class Logist(object):
     def _export(self, flush=False, filelocation= "",filename="", date_from="", date_to="", log_type="", sub_type="", description="", 
             log_source="redis", force_refresh=False):
         """
-        #TODO Flush Data
         Function to export all availale data to a csv file
-        :param flush : False - detemines to flush exported data
+        :param flush : False - detemines to flush exported data, True removes the exported logs from redis
         :param filename : filename to save data
         :param date_to: filter logs till date_to - datetime object
         :param date_from: filter logs till date_from - datetime object
-        :param log_source: redis/file
+        :param log_source: redis/file/archive (all rotated segments and the live file)
         :param log_type: type of log - ERROR, WARNING, SUCCESS, INFO, DEBUG
         :param sub_type: custom log sub types for easy tracking - Eg: ACCESS, WRITE, READ, EDIT, DELETE
         :param description: brief log description
@@ -348,8 +2609,6 @@ class Logist(object):
         :return: None
         """
 
-        self.export_data = self._filter(log_source, date_from, date_to, log_type, sub_type, description, force_refresh)
-
         if filename:
             file_name = "%s.csv" % (filename)
         else:
@@ -360,27 +2619,63 @@ class Logist(object):
         else:
             filelocation = file_name
 
-        log_file = open(filelocation, 'w')
-        writer = csv.writer(log_file)
-        print self.export_data
-        for log in self.export_data:
-            writer.writerow(log)
-        log_file.close()
+        with open(filelocation, 'w') as log_file:
+            writer = csv.writer(log_file)
+            if flush and log_source not in ("file", "archive"):
+                date_from, date_to = self._date_range(date_from, date_to)
+                self._export_flush(writer, date_from, date_to, log_type, sub_type, description)
+            else:
+                for log in self._filter(log_source, date_from, date_to, log_type, sub_type, description,
+                                        force_refresh):
+                    writer.writerow(log)
 
-        self._delete_data(date_from, date_to, log_type, sub_type, description, log_source, force_refresh)
+        return
 
+    def _export_flush(self, writer, date_from, date_to, log_type, sub_type, description):
+        """
+        Private function exporting matching logs from redis and removing them in a single pass
+        The list is detached atomically (RENAME for redis), then streamed in chunks: matching logs go to the csv writer,
+        the rest is pushed back to the tail of the namespace, behind anything logged meanwhile, so order is kept.
+        :param writer: csv writer for the exported rows
+        :param date_from: epoch seconds
+        :param date_to: epoch seconds
+        :return: None
+        """
+        self._m_flush()
+        batch = self.backend.detach()
+        if batch is None:
+            # nothing in redis to export
+            return
+        # logs put back are counted again by release()
+        self.backend.detached_rollup(batch)
+        while 1:
+            chunk = self.backend.read(batch, FLUSH_CHUNK_SIZE)
+            if not chunk:
+                break
+            kept = []
+            for record in chunk:
+                try:
+                    log_time, log_type_re, sub_type_re, description_re = _parse_record(record)
+                except ValueError:
+                    kept.append(record)
+                    continue
+                if date_from < log_time < date_to and log_type in log_type_re and sub_type in sub_type_re \
+                        and description in description_re:
+                    writer.writerow([EPOCH + timedelta(seconds=log_time), log_type_re, sub_type_re, description_re])
+                else:
+                    kept.append(record)
+            self.backend.release(batch, len(chunk), restore=kept)
         return
 
     def export(self, flush=False, filelocation= "",filename="", date_from="", date_to="", log_type="", sub_type="", description="", 
             log_source="redis", force_refresh=False):
         """
-        #TODO Flush Data
         Function to export all availale data to a csv file
-        :param flush : False - detemines to flush exported data
+        :param flush : False - detemines to flush exported data, True removes the exported logs from redis
         :param filename : filename to save data
         :param date_to: filter logs till date_to - datetime object
         :param date_from: filter logs till date_from - datetime object
-        :param log_source: redis/file
+        :param log_source: redis/file/archive (all rotated segments and the live file)
         :param log_type: type of log - ERROR, WARNING, SUCCESS, INFO, DEBUG
         :param sub_type: custom log sub types for easy tracking - Eg: ACCESS, WRITE, READ, EDIT, DELETE
         :param description: brief log description
@@ -389,25 +2684,3 @@ class Logist(object):
         """ 
 
         return self._export(flush, filelocation, filename, date_from, date_to, log_type, sub_type, description, log_source, force_refresh)
-
-    def _delete_data(self, date_from, date_to, log_type, sub_type, description, log_source, force_refresh):
-        """
-        :param log_source: redis/file
-        :param log_type: type of log - ERROR, WARNING, SUCCESS, INFO, DEBUG
-        :param sub_type: custom log sub types for easy tracking - Eg: ACCESS, WRITE, READ, EDIT, DELETE
-        :param description: brief log description
-        """
-        append_list = []
-
-        logs_redis = self.redis_instance.lrange(self.NAMESPACE, 0, -1)
-        for log in logs_redis:
-            log_time = datetime.strptime(log.split(" ><")[0], "%Y-%m-%dT%H:%M:%SZ")
-            log_type_re = log.split(">< ")[1].split(" :: ")[0]
-            sub_type_re = log.split(":: ")[1].split(" || ")[0]
-            description_re = log.split("|| ")[1]
-            date_to_time = date_to if date_to else datetime.now()
-            if log_type_re == log_type or sub_type_re == sub_type or description_re == description or (date_from < log_time < date_to_time):
-                self.redis_instance.lrem(self.NAMESPACE,log)
-                append_list.append(log)
-
-        return
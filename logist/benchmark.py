@@ -0,0 +1,184 @@
+"""
+Benchmarks of the logist hot paths
+
+    python -m logist.benchmark --backend memory --sizes 10000,1000000,10000000
+
+Measures write throughput (sync, batched and background), flush and rotation latency,
+the parse rate of the index bootstrap and filter()/count() latency at the given sizes,
+against a local redis server or the in-process memory backend.
+Runs in a temporary folder, so no logist_config.json of the working directory applies.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from itertools import repeat
+
+from logist import Logist, MemoryBackend, FLUSH_CHUNK_SIZE, TIME_FORMAT, _format_binary, _to_epoch, _utf8
+
+LOG_TYPES = ["SUCCESS", "ERROR", "INFO", "WARNING"]
+SUB_TYPES = ["ACCESS", "WRITE", "READ", "EDIT", "DELETE"]
+DESCRIPTIONS = ["d1", "d2", "d3", "d4", "d5", "d6"]
+
+
+def _logger(options, label, **kwargs):
+    """
+    Logist writing to a fresh namespace, with its log files in the working directory
+    """
+    settings = dict(namespace="BENCHMARK_%s_%s" % (label.upper(), uuid.uuid4().hex[:8]), log_file_name=label,
+                    record_format=options.record_format, flush_count=options.flush_count)
+    settings.update(kwargs)
+    if options.backend == "memory" and "backend" not in settings:
+        settings["backend"] = "memory"
+    return Logist(**settings)
+
+
+def _reset(logger):
+    """
+    Drop whatever a benchmark left in the backend
+    """
+    for shard in logger.backend.shards():
+        redis_instance = getattr(shard, "redis_instance", None)
+        if redis_instance is not None:
+            redis_instance.delete(shard.namespace, shard.generation_key, *shard.rollup_keys)
+        else:
+            shard.detach()
+    logger.close()
+
+
+def _records(count, record_format):
+    """
+    count random log records spread over the last hour, oldest first
+    """
+    now = int(time.time())
+    stamp_second, stamp = None, None
+    for index, _ in enumerate(repeat(None, count)):
+        second = now - 3600 + index * 3600 // count
+        if second != stamp_second:
+            stamp_second = second
+            log_time = datetime.fromtimestamp(second)
+            stamp = _to_epoch(log_time) if record_format == "binary" else log_time.strftime(TIME_FORMAT)
+        log_type, sub_type, description = random.choice(LOG_TYPES), random.choice(SUB_TYPES), \
+            random.choice(DESCRIPTIONS)
+        if record_format == "binary":
+            yield _format_binary(stamp, log_type, sub_type, description)
+        else:
+            yield _utf8("%s >< %s :: %s || %s" % (stamp, log_type, sub_type, description))
+
+
+def _load(logger, count, record_format):
+    """
+    Push count records straight to the backend, in FLUSH_CHUNK_SIZE batches and without flushing
+    """
+    chunk = []
+    for record in _records(count, record_format):
+        chunk.append(record)
+        if len(chunk) == FLUSH_CHUNK_SIZE:
+            logger.backend.push(chunk)
+            chunk = []
+    if chunk:
+        logger.backend.push(chunk)
+
+
+def _timed(function, *args, **kwargs):
+    """
+    :return: (seconds taken, result)
+    """
+    start = time.time()
+    result = function(*args, **kwargs)
+    return time.time() - start, result
+
+
+def bench_writes(options):
+    """
+    Write throughput of log() with synchronous, batched and background writes, flushing to file included
+    """
+    modes = [("sync", {}), ("batched", {"batch_size": 500}), ("background", {"background": True})]
+    for label, kwargs in modes:
+        logger = _logger(options, label, **kwargs)
+        start = time.time()
+        for _ in repeat(None, options.entries):
+            logger.log(random.choice(LOG_TYPES), random.choice(SUB_TYPES), random.choice(DESCRIPTIONS))
+        logger.close()
+        seconds = time.time() - start
+        stats = logger.stats()
+        print("write %-10s %10.0f logs/second (%d flushes, %d dropped)" % (label, options.entries / seconds,
+                                                                           stats["flushes"], stats["dropped"]))
+        _reset(logger)
+
+
+def bench_flush(options):
+    """
+    Latency of flushing FLUSH_COUNT logs to file, of rotating the file and of sealing (gzip) the segment
+    """
+    logger = _logger(options, "flush", flusher=False)
+    _load(logger, options.flush_count, options.record_format)
+    flush_seconds = _timed(logger._f_write)[0]
+    rotate_seconds = _timed(logger._f_compress, logger._log_file_location())[0]
+    start = time.time()
+    for thread in logger._seal_threads:
+        thread.join()
+    seal_seconds = time.time() - start
+    stats = logger.stats()
+    print("flush %d logs %.4fs, rotate %d bytes %.4fs, seal %.4fs" % (options.flush_count, flush_seconds,
+                                                                      stats["rotated_bytes"], rotate_seconds,
+                                                                      seal_seconds))
+    _reset(logger)
+
+
+def bench_queries(options):
+    """
+    Bootstrap parse rate and filter()/count() latency for every size in options.sizes
+    """
+    for size in options.sizes:
+        kwargs = {"flusher": False, "rollups": True}
+        if options.backend == "memory":
+            kwargs["backend"] = MemoryBackend(max_entries=size)
+        logger = _logger(options, "query", **kwargs)
+        load_seconds = _timed(_load, logger, size, options.record_format)[0]
+        bootstrap_seconds = _timed(logger._analytics_bootstrap)[0]
+        count_seconds, matched = _timed(logger.count, log_type="ERROR", sub_type="ACCESS")
+        described_seconds = _timed(logger.count, log_type="ERROR", description="d1")[0]
+        filter_seconds, rows = _timed(logger.filter, log_type="ERROR", sub_type="ACCESS")
+        logger.ROLLUPS = False
+        indexed_seconds = _timed(logger.count, log_type="ERROR", sub_type="ACCESS")[0]
+        print("%d logs: load %.2fs, bootstrap %.2fs (%.0f parsed/second)" % (size, load_seconds, bootstrap_seconds,
+                                                                             size / bootstrap_seconds))
+        print("    count %.6fs rollups, %.6fs index, %.6fs with description; filter %.6fs (%d of %d rows)" % (
+            count_seconds, indexed_seconds, described_seconds, filter_seconds, len(rows), matched))
+        if logger.redis_instance is not None:
+            logger.SERVER_QUERY = True
+            server_seconds = _timed(logger.count, log_type="ERROR", sub_type="ACCESS")[0]
+            print("    count %.6fs server side" % server_seconds)
+        stats = logger.stats()
+        print("    log_list cache %d hits, %d misses" % (stats["log_list_hits"], stats["log_list_misses"]))
+        _reset(logger)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark logist write, flush and query paths")
+    parser.add_argument("--backend", choices=["redis", "memory"], default="memory")
+    parser.add_argument("--entries", type=int, default=100000, help="logs written per write benchmark")
+    parser.add_argument("--flush-count", type=int, default=10000)
+    parser.add_argument("--sizes", default="10000,1000000,10000000", help="comma separated query benchmark sizes")
+    parser.add_argument("--record-format", choices=["text", "binary"], default="text")
+    options = parser.parse_args()
+    options.sizes = [int(size) for size in options.sizes.split(",") if size]
+    folder = tempfile.mkdtemp(prefix="logist-benchmark-")
+    cwd = os.getcwd()
+    os.chdir(folder)
+    try:
+        bench_writes(options)
+        bench_flush(options)
+        bench_queries(options)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,441 @@
+import os
 import random
-from datetime import datetime
-from __init__ import Logist
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import multiprocessing
+from datetime import datetime, timedelta
+try:
+    from logist import Logist, MemoryBackend, Redis, SharedMemoryBackend, TIME_FORMAT, _parse_record, _parse_time, _to_epoch
+except ImportError:
+    # run from inside the package folder: python tests.py [benchmark]
+    from __init__ import Logist, MemoryBackend, Redis, SharedMemoryBackend, TIME_FORMAT, _parse_record, _parse_time, _to_epoch
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
 
-l = Logist(flush_count=10000, file_size=10000000, disable_file_flush=True)
 types = ["SUCCESS", "ERROR", "INFO", "WARNING"]
 sub_types = ["ACCESS", "WRITE", "READ", "EDIT", "DELETE"]
 descriptions = ["d1", "d2", "d3", "d4", "d5", "d6"]
-start = datetime.now()
 log_count = 105500
-for log in xrange(log_count):
-    log_type = types[random.randint(0, 3)]
-    log_sub_type = sub_types[random.randint(0, 4)]
-    description = descriptions[random.randint(0, 5)]
-    l.log(log_type, log_sub_type, description)
-time_delta = datetime.now() - start
-print("Benchmark\n%d requests in %s\n %f logs/second" % (log_count, time_delta, log_count/time_delta.seconds))
-print(l.count(log_source="file", date_from=datetime(2016, 1, 2), sub_type="ACCESS", log_type="ERROR"))
-print(l.count(log_source="memory", date_from=datetime(2016, 1, 2), sub_type="EDIT", log_type="INFO"))
-
-
-# TODO - tests for compression switch, memory/file switch, filters, count
+
+
+class LogistTestCase(unittest.TestCase):
+    """
+    Runs every test in an empty temporary folder, so log files and logist_config.json of the
+    working directory do not leak in; loggers use the memory backend and need no redis server
+    """
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.folder = tempfile.mkdtemp(prefix="logist-test-")
+        os.chdir(self.folder)
+        self.loggers = []
+        random.seed(7)
+
+    def tearDown(self):
+        for logger in self.loggers:
+            logger.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def logger(self, **kwargs):
+        kwargs.setdefault("backend", "memory")
+        logger = Logist(**kwargs)
+        self.loggers.append(logger)
+        return logger
+
+    @staticmethod
+    def write(logger, count, log_time=None):
+        for index in range(count):
+            logger.log(types[index % 4], sub_types[index % 5], descriptions[index % 6],
+                       log_time + timedelta(seconds=index) if log_time else None)
+
+    @staticmethod
+    def file_lines(name):
+        with open(name, "rb") as log_file:
+            return log_file.read().splitlines()
+
+
+class WriteTest(LogistTestCase):
+    def test_batch_is_pushed_when_full(self):
+        logger = self.logger(batch_size=5)
+        self.write(logger, 4)
+        self.assertEqual(logger.backend.length(), 0)
+        self.write(logger, 1)
+        self.assertEqual(logger.backend.length(), 5)
+
+    def test_batch_is_pushed_after_interval(self):
+        logger = self.logger(batch_size=100, batch_interval=0.1)
+        self.write(logger, 1)
+        time.sleep(0.5)
+        self.assertEqual(logger.backend.length(), 1)
+
+    def test_background_writer_pushes_everything(self):
+        logger = self.logger(background=True)
+        self.write(logger, 200)
+        logger.close()
+        self.assertEqual(logger.backend.length(), 200)
+        self.assertEqual(logger.queue_stats(), {"queued": 200, "dropped": 0, "pending": 0})
+
+    def test_queue_policies(self):
+        for policy, kept in [("drop_new", ["e0", "e1"]), ("drop_oldest", ["e3", "e4"])]:
+            # a queue no writer thread drains
+            logger = self.logger(queue_policy=policy)
+            logger._queue = Queue(maxsize=2)
+            for index in range(5):
+                logger._q_put("e%d" % index)
+            self.assertEqual([logger._queue.get_nowait() for _ in range(2)], kept)
+            self.assertEqual(logger.queue_stats()["dropped"], 3)
+            logger._queue = None
+
+
+class FlushTest(LogistTestCase):
+    def test_flush_moves_logs_to_file(self):
+        logger = self.logger(flush_count=50)
+        self.write(logger, 120)
+        self.assertEqual(len(self.file_lines("default.log")), 100)
+        self.assertEqual(logger.backend.length(), 20)
+        self.assertEqual(logger.stats()["flushes"], 2)
+
+    def test_disable_file_flush_trims(self):
+        logger = self.logger(flush_count=50, disable_file_flush=True)
+        self.write(logger, 120)
+        self.assertFalse(os.path.exists("default.log"))
+        self.assertEqual(logger.backend.length(), 50)
+
+    def test_rotated_segments_are_sealed_and_queried(self):
+        logger = self.logger(flush_count=20, file_size=2000, log_file_name="rotate")
+        self.write(logger, 300, datetime(2020, 1, 1))
+        logger.close()
+        names = os.listdir(".")
+        segments = [name for name in names if name.endswith(".log.gz")]
+        self.assertTrue(segments)
+        self.assertTrue(all("%s.meta" % name[:-3] in names for name in segments))
+        stored = logger.backend.length()
+        self.assertEqual(logger.count(log_source="archive") + stored, 300)
+        # sidecar counts and scanning agree
+        date_from, date_to = datetime(2020, 1, 1, 0, 1), datetime(2020, 1, 1, 0, 4)
+        self.assertEqual(logger.count(log_source="archive", date_from=date_from, date_to=date_to, log_type="ERROR"),
+                         logger.count(log_source="archive", date_from=date_from, date_to=date_to, log_type="ERROR",
+                                      description="d"))
+        self.assertEqual(len(logger.filter(log_source="archive", date_from=date_from, date_to=date_to)), 179)
+
+    def test_rollup_sidecars_count_flushed_logs(self):
+        logger = self.logger(rollups=True, flush_count=20, file_size=2000, log_file_name="counted")
+        self.write(logger, 290, datetime(2020, 1, 1))
+        logger.close()
+        names = os.listdir(".")
+        self.assertTrue(all("%s.rollup" % name[:-3] in names for name in names if name.endswith(".log.gz")))
+        queries = [{}, {"log_type": "ERROR", "sub_type": "READ"},
+                   {"date_from": datetime(2020, 1, 1, 0, 1), "date_to": datetime(2020, 1, 1, 0, 4), "log_type": "I"}]
+        for query in queries:
+            for source in ["file", "archive"]:
+                self.assertEqual(logger.count(log_source=source, **query),
+                                 logger.count(log_source=source, description="d", force_refresh=True, **query))
+        self.assertTrue(os.path.isfile("counted.log.rollup"))
+        # logs flushed without counters leave the sidecar of the live file incomplete
+        uncounted = self.logger(flush_count=20, log_file_name="counted")
+        self.write(uncounted, 20, datetime(2020, 1, 2))
+        self.assertEqual(logger.count(log_source="file", force_refresh=True), len(self.file_lines("counted.log")))
+        self.assertEqual(logger.count(log_source="archive"), 280 + 20)
+
+    def test_export_flush_keeps_the_rest(self):
+        logger = self.logger()
+        self.write(logger, 100, datetime(2020, 1, 1))
+        logger.export(flush=True, filename="read", sub_type="READ")
+        with open("read.csv") as csv_file:
+            self.assertEqual(len(csv_file.read().splitlines()), 20)
+        self.assertEqual(logger.count(force_refresh=True), 80)
+        self.assertEqual(logger.count(sub_type="READ"), 0)
+
+
+class FormatTest(LogistTestCase):
+    def test_binary_record_round_trip(self):
+        description = "line one\nline two :: not a sub type || not a description"
+        logger = self.logger(record_format="binary", flush_count=2)
+        logger.info("ACCESS", description, datetime(2020, 1, 1))
+        logger.log("CUSTOM", "OTHER", "plain", datetime(2020, 1, 2))
+        expected = [[datetime(2020, 1, 1), "INFO", "ACCESS", description],
+                    [datetime(2020, 1, 2), "CUSTOM", "OTHER", "plain"]]
+        self.assertEqual(logger.filter(log_source="file"), expected)
+        logger.info("ACCESS", description, datetime(2020, 1, 3))
+        self.assertEqual(logger.filter(date_from=datetime(2020, 1, 2), force_refresh=True)[0][3], description)
+
+    def test_binary_unicode(self):
+        logger = self.logger(record_format="binary")
+        logger.info("ACCESS", u"caf\xe9 \u2603")
+        description = logger.filter(force_refresh=True)[0][3]
+        if isinstance(description, bytes):
+            # Python 2 hands back the UTF-8 encoded str
+            description = description.decode("utf-8")
+        self.assertEqual(description, u"caf\xe9 \u2603")
+
+    def test_text_timestamp_parser_matches_strptime(self):
+        for _ in range(10000):
+            log_time = datetime(1990, 1, 1) + timedelta(seconds=random.randint(0, 2 * 10 ** 9))
+            self.assertEqual(_parse_time(log_time.strftime(TIME_FORMAT)), _to_epoch(log_time))
+        for malformed in ["2020-01-01 00:00:00Z", "2020-01-01T24:00:00Z", "2020-13-01T00:00:00Z", "garbage"]:
+            self.assertRaises(ValueError, _parse_time, malformed)
+
+    def test_cached_time_prefix(self):
+        logger = self.logger()
+        before = _to_epoch(datetime.now().replace(microsecond=0))
+        log_time = _parse_record(logger._m_format("INFO", "ACCESS", "d1"))[0]
+        self.assertTrue(before <= log_time <= _to_epoch(datetime.now()))
+
+
+class QueryTest(LogistTestCase):
+    queries = [{}, {"log_type": "ERROR"}, {"sub_type": "READ", "description": "d4"},
+               {"date_from": datetime(2020, 1, 1, 0, 2), "date_to": datetime(2020, 1, 1, 0, 5), "log_type": "I"}]
+
+    def assertQueriesAgree(self, logger, setting):
+        for query in self.queries:
+            setattr(logger, setting, True)
+            fast = logger.count(**query), logger.filter(**query)
+            setattr(logger, setting, False)
+            self.assertEqual(fast, (logger.count(force_refresh=True, **query), logger.filter(**query)))
+
+    def test_server_and_local_queries_agree(self):
+        logger = self.logger()
+        self.write(logger, 500, datetime(2020, 1, 1))
+        self.assertQueriesAgree(logger, "SERVER_QUERY")
+
+    def test_rollup_and_index_counts_agree(self):
+        for kwargs in [{}, {"batch_size": 7}, {"background": True}, {"shards": 3, "batch_size": 7}]:
+            logger = self.logger(rollups=True, flush_count=300, **kwargs)
+            self.write(logger, 500, datetime(2020, 1, 1))
+            logger.close()
+            self.assertIsNotNone(logger.backend.rollup_counts())
+            self.assertEqual(logger.count(), logger.backend.length())
+            self.assertQueriesAgree(logger, "ROLLUPS")
+
+    def test_rollups_ignore_uncounted_logs(self):
+        backend = MemoryBackend()
+        self.write(self.logger(backend=backend), 100)
+        logger = self.logger(backend=backend, rollups=True, flush_count=200, log_file_name="mixed")
+        self.write(logger, 10)
+        self.assertEqual(logger.count(), 110)
+        logger._f_write()
+        self.assertEqual(logger.count(log_source="file"), 110)
+        self.write(logger, 10)
+        # counting starts over on the emptied backend
+        self.assertIsNotNone(logger.backend.rollup_counts())
+        self.assertEqual(logger.count(), 10)
+
+    def test_sharded_queries(self):
+        logger = self.logger(shards=3, shard_by="hash")
+        self.write(logger, 300, datetime(2020, 1, 1))
+        self.assertTrue(all(shard.length() for shard in logger.backend.shards()))
+        self.assertEqual(logger.count(), 300)
+        rows = logger.filter()
+        self.assertEqual(rows, sorted(rows, key=lambda row: row[0]))
+        self.assertQueriesAgree(logger, "SERVER_QUERY")
+
+    def test_background_writes_spread_over_shards(self):
+        for kwargs in [{"background": True}, {"batch_size": 10}]:
+            logger = self.logger(shards=3, **kwargs)
+            self.assertEqual(logger.SHARD_BY, "hash")
+            self.write(logger, 300)
+            logger.close()
+            self.assertTrue(all(shard.length() for shard in logger.backend.shards()))
+            self.assertEqual(logger.backend.length(), 300)
+
+    def test_incremental_refresh(self):
+        logger = self.logger()
+        self.write(logger, 10, datetime(2020, 1, 1))
+        self.assertEqual(logger.count(), 10)
+        self.write(logger, 5, datetime(2020, 1, 2))
+        self.assertEqual(logger.count(), 10)
+        self.assertEqual(logger.count(force_refresh=True), 15)
+        self.assertEqual(logger.stats()["log_list_misses"], 2)
+
+
+class SharedMemoryTest(LogistTestCase):
+    def test_long_entries_spill_over(self):
+        for record_format in ["text", "binary"]:
+            logger = self.logger(backend=SharedMemoryBackend("%s.ring" % record_format, slot_size=128),
+                                 record_format=record_format, flush_count=150, log_file_name=record_format)
+            self.write(logger, 100, datetime(2020, 1, 1))
+            logger.info("ACCESS", "x" * 600, datetime(2020, 1, 1, 1))
+            self.write(logger, 99, datetime(2020, 1, 1, 2))
+            rows = logger.filter(log_source="file") + logger.filter(force_refresh=True)
+            self.assertEqual(len(rows), 200)
+            self.assertEqual([row[3] for row in rows if len(row[3]) > 2], ["x" * 600])
+
+    def test_flush_count_is_capped_by_ring_size(self):
+        logger = self.logger(backend=SharedMemoryBackend("capped.ring", slots=100), flush_count=200,
+                             log_file_name="capped")
+        self.assertEqual(logger.FLUSH_COUNT, 75)
+        self.write(logger, 500)
+        self.assertEqual(len(self.file_lines("capped.log")) + logger.backend.length(), 500)
+
+    def test_entry_larger_than_ring(self):
+        backend = SharedMemoryBackend("small.ring", slots=4, slot_size=16)
+        self.assertRaises(ValueError, backend.push, [b"kept", b"x" * 100])
+        self.assertEqual(backend.read_new(), (0, [b"kept"]))
+        backend.close()
+
+
+@unittest.skipIf(Redis is None, "redis is not installed")
+class SpoolTest(LogistTestCase):
+    def test_logs_are_spooled_while_redis_is_down(self):
+        logger = self.logger(backend="redis", redis_port=1, log_file_name="down")
+        self.write(logger, 3)
+        self.assertEqual(len(self.file_lines("down.spool")), 3)
+
+    def test_logs_are_spooled_while_redis_does_not_answer(self):
+        # accepts connections, but never reads from them
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(5)
+        module = sys.modules[Logist.__module__]
+        timeout, module.REDIS_TIMEOUT = module.REDIS_TIMEOUT, 0.2
+        try:
+            logger = self.logger(backend="redis", redis_port=server.getsockname()[1], log_file_name="hung")
+            self.write(logger, 3)
+        finally:
+            module.REDIS_TIMEOUT = timeout
+            server.close()
+        self.assertEqual(len(self.file_lines("hung.spool")), 3)
+
+    def test_logs_do_not_wait_for_redis_timeout(self):
+        # only the probe, with its short timeout, talks to a redis that never answers
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(5)
+        module = sys.modules[Logist.__module__]
+        started = time.time()
+        try:
+            logger = self.logger(backend="redis", redis_port=server.getsockname()[1], log_file_name="slow")
+            self.write(logger, 3)
+        finally:
+            server.close()
+        self.assertLess(time.time() - started, module.REDIS_TIMEOUT)
+        self.assertEqual(len(self.file_lines("slow.spool")), 3)
+
+    def test_logs_are_spooled_while_redis_runs_a_slow_script(self):
+        # answers every command like redis stuck in a script past lua-time-limit
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(5)
+
+        def answer():
+            connection = server.accept()[0]
+            while connection.recv(65536):
+                connection.sendall(b"-BUSY Redis is busy running a script. You can only call SCRIPT KILL "
+                                   b"or SHUTDOWN NOSAVE.\r\n")
+        thread = threading.Thread(target=answer)
+        thread.daemon = True
+        thread.start()
+        try:
+            logger = self.logger(backend="redis", redis_port=server.getsockname()[1], log_file_name="busy")
+            self.write(logger, 3)
+        finally:
+            server.close()
+        self.assertEqual(len(self.file_lines("busy.spool")), 3)
+
+
+def benchmark(logger, label):
+    start = datetime.now()
+    for log in range(log_count):
+        log_type = types[random.randint(0, 3)]
+        log_sub_type = sub_types[random.randint(0, 4)]
+        description = descriptions[random.randint(0, 5)]
+        logger.log(log_type, log_sub_type, description)
+    logger.close()
+    time_delta = datetime.now() - start
+    print("Benchmark (%s)\n%d requests in %s\n %f logs/second" % (label, log_count, time_delta,
+                                                                  log_count / time_delta.total_seconds()))
+
+
+def benchmarks():
+    l = Logist(flush_count=10000, file_size=10000000, disable_file_flush=True)
+    benchmark(l, "sync")
+    benchmark(Logist(flush_count=10000, file_size=10000000, disable_file_flush=True, batch_size=500), "batched")
+    benchmark(Logist(flush_count=10000, file_size=10000000, disable_file_flush=True, backend="memory"), "memory backend")
+    print(l.count(log_source="file", date_from=datetime(2016, 1, 2), sub_type="ACCESS", log_type="ERROR"))
+    print(l.count(log_source="memory", date_from=datetime(2016, 1, 2), sub_type="EDIT", log_type="INFO"))
+    print(l.stats())
+
+    rollups = Logist(namespace="BENCHMARK_ROLLUPS", batch_size=500, rollups=True)
+    # logist_config.json may disable file flush, which turns rollups off; keep every log in redis instead
+    rollups.FLUSH_COUNT, rollups.DISABLE_FILE_FLUSH = log_count + 1, False
+    rollups.backend.rollups = True
+    benchmark(rollups, "rollups")
+    for use_rollups in [False, True]:
+        rollups.ROLLUPS = use_rollups
+        start = datetime.now()
+        matched = rollups.count(log_type="ERROR", sub_type="ACCESS", force_refresh=True)
+        print("count with rollups=%s: %d matches in %s" % (use_rollups, matched, datetime.now() - start))
+
+    for record_format in ["text", "binary"]:
+        formatted = Logist(namespace="BENCHMARK_%s" % record_format.upper(), disable_file_flush=True, batch_size=500,
+                           record_format=record_format)
+        benchmark(formatted, record_format)
+        records = formatted.backend.read_new()[1]
+        start = datetime.now()
+        parsed = len(list(formatted._parse_lines(records)))
+        time_delta = datetime.now() - start
+        print("%s records: %f bytes/entry, %f parsed/second" % (record_format,
+                                                               sum(len(record) for record in records) / float(parsed),
+                                                               parsed / time_delta.total_seconds()))
+
+    # format and parse cost per entry, without any backend round-trip
+    formatter = Logist(namespace="BENCHMARK_FORMAT", disable_file_flush=True)
+    for record_format in ["text", "binary"]:
+        formatter.RECORD_FORMAT = record_format
+        start = datetime.now()
+        records = [formatter._m_format("INFO", "ACCESS", "d1") for log in range(log_count)]
+        format_time = (datetime.now() - start).total_seconds()
+        start = datetime.now()
+        for record in records:
+            _parse_record(record)
+        parse_time = (datetime.now() - start).total_seconds()
+        print("%s: format %f us/entry, parse %f us/entry" % (record_format, format_time * 1e6 / log_count,
+                                                             parse_time * 1e6 / log_count))
+    start = datetime.now()
+    records = ["%s >< INFO :: ACCESS || d1" % datetime.strftime(datetime.now(), TIME_FORMAT) for log in range(log_count)]
+    format_time = (datetime.now() - start).total_seconds()
+    start = datetime.now()
+    for record in records:
+        datetime.strptime(record[:20], TIME_FORMAT)
+    parse_time = (datetime.now() - start).total_seconds()
+    print("strftime/strptime: format %f us/entry, parse %f us/entry" % (format_time * 1e6 / log_count,
+                                                                        parse_time * 1e6 / log_count))
+
+    for shards in [1, 4]:
+        sharded = Logist(namespace="BENCHMARK_SHARDED", disable_file_flush=True, batch_size=500, shards=shards)
+        writers = [multiprocessing.Process(target=benchmark, args=(sharded, "%d shards, writer %d" % (shards, writer)))
+                   for writer in range(4)]
+        start = datetime.now()
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        time_delta = datetime.now() - start
+        print("%d shards: %f logs/second from 4 writers" % (shards, 4 * log_count / time_delta.total_seconds()))
+
+    archive = Logist(flush_count=10000, file_size=1000000, log_file_name="benchmark_archive", namespace="BENCHMARK",
+                     batch_size=500)
+    # logist_config.json takes precedence over arguments, make sure this run actually rotates segments
+    archive.DISABLE_FILE_FLUSH, archive.FILE_SIZE = False, 1000000
+    benchmark(archive, "archive")
+    for scan_workers in sorted(set([1, 2, 4, multiprocessing.cpu_count()])):
+        scanner = Logist(log_file_name="benchmark_archive", namespace="BENCHMARK", scan_workers=scan_workers)
+        start = datetime.now()
+        matched = scanner.count(log_source="archive", sub_type="ACCESS", log_type="ERROR")
+        time_delta = datetime.now() - start
+        scanner.close()
+        print("Archive count with %d scan workers: %d matches in %s" % (scan_workers, matched, time_delta))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["benchmark"]:
+        benchmarks()
+    else:
+        unittest.main()
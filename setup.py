@@ -11,6 +11,7 @@ setup(name='logist',
       packages=['logist'],
       zip_safe=False, requires=['redis'],
       install_requires=[
-          "redis"
+          "redis",
+          "futures; python_version < '3'"
       ]
       )